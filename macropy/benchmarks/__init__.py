@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Throughput benchmarks for the macros shipped with MacroPy.
+
+Each submodule is a suite exposing a ``run(options)`` function, which
+yields one result dict per measurement. Run all of them with ``python
+run_benchmarks.py`` from the root of the repository, or only some with
+e.g. ``python run_benchmarks.py peg``. ``--save`` writes the results
+to a JSON file, and ``--compare`` prints the speedup of the current
+run against such a file, to compare two versions of the code.
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import math
+import sys
+import time
+import tracemalloc
+
+
+SUITES = ['case_classes', 'lazy', 'pattern', 'peg', 'string_interp', 'tco']
+
+try:
+    import sqlalchemy  # noqa: F401
+    SUITES.append('pinq')
+except ImportError:
+    pass
+
+
+def activate_worker():
+    """Initializer of process pools, for the workers which do not inherit
+    an activated MacroPy from a fork"""
+    from macropy.core import import_hooks
+    if import_hooks.MacroFinder not in sys.meta_path:
+        import macropy
+        macropy.activate()
+
+
+def measure(func, *args, repeat=3, nbytes=None, memory=True):
+    """Times ``func(*args)``, returning a result dict.
+
+    The time is the best of `repeat` runs. If `memory` is true, one more
+    run is traced to find the peak memory usage; `nbytes` is the size of
+    the input, used to derive the per-byte figures."""
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    result = {'seconds': best}
+    if nbytes:
+        result['bytes'] = nbytes
+        result['bytes/s'] = nbytes / best if best else float('inf')
+
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func(*args)
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result['peak'] = peak
+        if nbytes:
+            result['peak/B'] = peak / nbytes
+    return result
+
+
+def measure_sizes(options, name, generate, func):
+    """Yields the results of `func` on inputs of each of the requested
+    sizes, made by `generate(size)`.
+
+    Stops before a size whose run is expected to take more than
+    `options.budget` seconds, extrapolating from the growth observed
+    between the previous two sizes."""
+    timings = []
+    for size in options.sizes:
+        if timings:
+            last_size, last_seconds = timings[-1]
+            exponent = 1
+            if len(timings) > 1 and timings[-2][1] > 0:
+                exponent = math.log(last_seconds / timings[-2][1]) / \
+                    math.log(last_size / timings[-2][0])
+            exponent = min(max(exponent, 1), 2)
+            if last_seconds * (size / last_size) ** exponent > options.budget:
+                print("%-40s skipped, over budget" % (
+                    name + " " + format_size(size)))
+                break
+        data = generate(size)
+        result = measure(func, data, repeat=options.repeat, nbytes=len(data))
+        timings.append((size, result['seconds']))
+        yield name + " " + format_size(size), result
+
+
+def format_size(n):
+    for unit in ['B', 'KB', 'MB']:
+        if n < 1024 or unit == 'MB':
+            return ("%d%s" if n == int(n) else "%.1f%s") % (n, unit)
+        n /= 1024
+
+
+def format_result(result):
+    parts = ["%.4fs" % result['seconds']]
+    if 'bytes/s' in result:
+        parts.append(format_size(result['bytes/s']) + "/s")
+    if 'peak' in result:
+        parts.append("peak " + format_size(result['peak']))
+    if 'peak/B' in result:
+        parts.append("%.1f peak/B" % result['peak/B'])
+    return ", ".join(parts)
+
+
+def parse_size(text):
+    """'1KB' -> 1024"""
+    text = text.upper().rstrip('B')
+    for unit, factor in [('K', 1024), ('M', 1024 ** 2)]:
+        if text.endswith(unit):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('suites', nargs='*', default=SUITES,
+                        help="suites to run, among: " + ", ".join(SUITES))
+    parser.add_argument('--sizes', default='1KB,10KB,100KB,1MB,10MB,50MB',
+                        help="comma separated input sizes, where relevant")
+    parser.add_argument('--budget', type=float, default=30,
+                        help="skip the larger sizes of a benchmark once a "
+                        "run takes more than this many seconds")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare',
+                        help="compare the results with this JSON file")
+    options = parser.parse_args(argv)
+    options.sizes = sorted(parse_size(s) for s in options.sizes.split(','))
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for suite in options.suites:
+        module = importlib.import_module('macropy.benchmarks.' + suite)
+        print("== " + suite)
+        for name, result in module.run(options):
+            key = suite + ": " + name
+            results[key] = result
+            line = "%-40s %s" % (name, format_result(result))
+            if key in baseline and result['seconds']:
+                line += " (%.2fx)" % (baseline[key]['seconds'] /
+                                      result['seconds'])
+            print(line)
+            sys.stdout.flush()
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
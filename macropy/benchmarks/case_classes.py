@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Cost of the methods of case classes, next to a hand-written class
+with ``__slots__`` and to the reflective methods which read each field
+with ``getattr``, and throughput of their serialization."""
+
+import ast
+import importlib
+from importlib.machinery import ModuleSpec
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+from macropy.case_classes import (macros, case, frozen, case_transform,
+                                  pack_records, unpack_records)
+from macropy.core.gen_sym import gen_sym
+from macropy.core.import_hooks import MacroFinder
+
+from . import format_size, measure
+
+
+COUNT = 100000
+
+
+@case
+class Point(x, y, z):  # noqa: F821
+    pass
+
+
+@case
+class Trade(id, symbol, price, quantity, buy):  # noqa: F821
+    pass
+
+
+@frozen
+class FrozenPoint(x, y, z):  # noqa: F821
+    pass
+
+
+class SlotsPoint(object):
+    __slots__ = ['x', 'y', 'z']
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __eq__(self, other):
+        return (self.__class__ is other.__class__ and self.x == other.x and
+                self.y == other.y and self.z == other.z)
+
+    def __hash__(self):
+        return hash((self.x, self.y, self.z))
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.z))
+
+    def __repr__(self):
+        return "SlotsPoint(%s, %s, %s)" % (self.x, self.y, self.z)
+
+
+def reflective_eq(self, other):
+    """How case classes were compared before they read their fields
+    through ``_values``"""
+    try:
+        return self.__class__ == other.__class__ \
+            and all(getattr(self, x) == getattr(other, x)
+                    for x in self.__class__._fields)
+    except AttributeError:
+        return False
+
+
+def reflective_iter(self):
+    for x in self.__class__._fields:
+        yield getattr(self, x)
+
+
+def reflective_str(self):
+    return (self.__class__.__name__ + "(" +
+            ", ".join(str(getattr(self, x))
+                      for x in self.__class__._fields) + ")")
+
+
+def construct(cls):
+    for i in range(COUNT):
+        cls(i, 2, 3)
+
+
+def compare(eq, a, b):
+    for i in range(COUNT):
+        eq(a, b)
+
+
+def call(method, a):
+    for i in range(COUNT):
+        method(a)
+
+
+def unpack(a):
+    for i in range(COUNT):
+        x, y, z = a
+
+
+def lookup(cache, keys):
+    for i in range(COUNT // len(keys)):
+        for key in keys:
+            cache[key]
+
+
+def serialize(dumps, loads, records):
+    assert loads(dumps(records)) == records
+    return records
+
+
+def run_serialization(options, count=COUNT):
+    """pickle and pack_records round trips of `count` records"""
+    records = [Trade(i, "SYM%d" % (i % 500), i * 0.25, i % 1000, i % 2 == 0)
+               for i in range(count)]
+    for name, dumps, loads in [
+            ("pickle", lambda r: pickle.dumps(r, pickle.HIGHEST_PROTOCOL),
+             pickle.loads),
+            ("pack_records", pack_records, unpack_records)]:
+        data = dumps(records)
+        label = "%s %d records (%s)" % (name, count, format_size(len(data)))
+        yield label + " dump", measure(dumps, records, repeat=options.repeat,
+                                       nbytes=len(data), memory=False)
+        yield label + " load", measure(loads, data, repeat=options.repeat,
+                                       nbytes=len(data), memory=False)
+        yield label + " round trip", measure(
+            serialize, dumps, loads, records, repeat=options.repeat)
+
+
+def run_batch(options, count=2 * COUNT):
+    """Memory held by `count` records in a list and in a Batch"""
+    def records():
+        return [Trade(i, "SYM%d" % (i % 500), i * 0.25, i % 1000, i % 2 == 0)
+                for i in range(count)]
+
+    batch = Trade.Batch(records())
+    columns = {name: list(batch.column(name)) for name in Trade._fields}
+    label = "%d records " % count
+    yield label + "list of instances", measure(records, repeat=1)
+    yield label + "Batch.from_columns", measure(
+        lambda: Trade.Batch.from_columns(**columns), repeat=1)
+    yield label + "Batch iteration", measure(
+        lambda: sum(t.price for t in batch), repeat=options.repeat,
+        memory=False)
+    yield label + "Batch filter", measure(
+        lambda: batch.filter(lambda t: t.buy), repeat=options.repeat,
+        memory=False)
+    yield label + "Batch copy", measure(
+        lambda: batch.copy(quantity=0), repeat=options.repeat, memory=False)
+    yield label + "Batch to_instances", measure(
+        batch.to_instances, repeat=options.repeat, memory=False)
+
+
+def linear_enum_new(cls, **kw):
+    """How enums were selected before they were indexed"""
+    [(k, v)] = kw.items()
+    for value in cls.all:
+        if getattr(value, k) == v:
+            return value
+    raise ValueError("No Enum found for %s=%s" % (k, v))
+
+
+def make_enum(count):
+    """Imports an enum with `count` members, whose code is generated in a
+    temporary module as the enum macro needs it in a source file"""
+    lines = ["from macropy.case_classes import macros, enum", "",
+             "@enum", "class Opcode(code):"]
+    lines += ["    Op%d(%d)" % (i, 1000 + i) for i in range(count)]
+    directory = tempfile.mkdtemp()
+    name = "bench_enum_%d" % count
+    try:
+        with open(os.path.join(directory, name + ".py"), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        sys.path.insert(0, directory)
+        try:
+            return importlib.import_module(name).Opcode
+        finally:
+            sys.path.remove(directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+def select(new, cls, codes, names):
+    for code in codes:
+        new(cls, code=code)
+    for name in names:
+        new(cls, name=name)
+
+
+def walk(member, steps):
+    for i in range(steps):
+        member = member.next
+    return member
+
+
+def run_enum(options, lookups=COUNT // 10):
+    for count in (10, 100, 500):
+        cls = make_enum(count)
+        codes = [1000 + i % count for i in range(lookups)]
+        names = ["Op%d" % (i % count) for i in range(lookups)]
+        for kind, new in (("indexed", cls.__new__),
+                          ("linear scan", linear_enum_new)):
+            yield "enum of %d, %d lookups %s" % (count, 2 * lookups, kind), \
+                measure(select, new, cls, codes, names,
+                        repeat=options.repeat, memory=False)
+        yield "enum of %d, %d next" % (count, lookups), measure(
+            walk, cls.all[0], lookups, repeat=options.repeat, memory=False)
+
+
+def generate_case_module(count):
+    """Source of a module declaring `count` case classes of various
+    shapes"""
+    lines = ["from macropy.case_classes import macros, case", ""]
+    for i in range(count):
+        lines += ["@case", "class Record%d(a, b | 0, [rest]):" % i,
+                  "    self.total = a + b",
+                  "    def scale(self, k):",
+                  "        self.factor = k",
+                  "        return [x * k for x in self.rest]",
+                  "    class Child%d(c):" % i,
+                  "        def get(this):",
+                  "            this.cached = this.c",
+                  "            return this.cached",
+                  ""]
+    return "\n".join(lines)
+
+
+def run_expansion(options, count=500):
+    """Expansion of a module of `count` case classes, without importing
+    it"""
+    source = generate_case_module(count)
+    spec = ModuleSpec("bench_case_expansion", None)
+    yield "expand %d case classes" % count, measure(
+        MacroFinder.expand_macros, source, "<bench>", spec,
+        repeat=options.repeat, nbytes=len(source), memory=False)
+
+    # the share of the case macro itself, without the generic walks of the
+    # expansion machinery
+    def transform():
+        tree = ast.parse(source)
+        symbols = gen_sym(tree)
+        for statement in tree.body[1:]:
+            case_transform(statement, symbols, [ast.Name(id="CaseClass")])
+
+    yield "case_transform %d classes (with parse)" % count, measure(
+        transform, repeat=options.repeat, memory=False)
+    yield "parse %d case classes" % count, measure(
+        ast.parse, source, repeat=options.repeat, memory=False)
+
+
+def run(options):
+    a, b = Point(1, 2, 3), Point(1, 2, 3)
+    slots_a, slots_b = SlotsPoint(1, 2, 3), SlotsPoint(1, 2, 3)
+    reflective = {
+        '__eq__': reflective_eq,
+        '__hash__': lambda self: hash(tuple(reflective_iter(self))),
+        '__repr__': reflective_str,
+    }
+
+    def bench(name, func, *args):
+        return "%s x%d" % (name, COUNT), measure(
+            func, *args, repeat=options.repeat, memory=False)
+
+    yield bench("construct case class", construct, Point)
+    yield bench("construct frozen case class", construct, FrozenPoint)
+    yield bench("construct slots class", construct, SlotsPoint)
+    yield bench("__eq__ case class", compare, Point.__eq__, a, b)
+    yield bench("__eq__ reflective", compare, reflective['__eq__'], a, b)
+    yield bench("__eq__ slots class", compare, SlotsPoint.__eq__,
+                slots_a, slots_b)
+    for method in ('__hash__', '__repr__'):
+        yield bench(method + " case class", call, getattr(Point, method), a)
+        yield bench(method + " reflective", call, reflective[method], a)
+        yield bench(method + " slots class", call,
+                    getattr(SlotsPoint, method), slots_a)
+    yield bench("unpack case class", unpack, a)
+    yield bench("unpack slots class", unpack, slots_a)
+
+    # memo cache keys: nested values, rebuilt for each lookup or shared
+    for cls in (Point, FrozenPoint):
+        keys = [cls(cls(i, i, i), (i, "x" * 20), i) for i in range(100)]
+        cache = dict.fromkeys(keys)
+        equal = [cls(cls(i, i, i), (i, "x" * 20), i) for i in range(100)]
+        kind = "frozen" if cls is FrozenPoint else "case"
+        yield bench("dict lookup %s class, equal keys" % kind, lookup,
+                    cache, equal)
+        yield bench("dict lookup %s class, same keys" % kind, lookup,
+                    cache, keys)
+
+    yield from run_serialization(options)
+    yield from run_batch(options)
+    yield from run_enum(options)
+    yield from run_expansion(options)
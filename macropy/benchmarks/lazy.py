@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Cost of the thunks of the ``lazy`` macro: calling one already
+evaluated, next to a function returning a constant, and creating and
+evaluating them."""
+
+from macropy.quick_lambda import macros, lazy
+
+from . import measure
+
+
+CALLS = 1000000
+THUNKS = 100000
+
+
+def call_thunk(thunk, count):
+    for i in range(count):
+        thunk()
+
+
+def create_thunks(count):
+    for i in range(count):
+        thunk = lazy[i + 1]
+        thunk()
+        thunk()
+
+
+def run(options):
+    thunk = lazy[sum(range(100))]
+    thunk()
+    yield "%dk calls evaluated lazy" % (CALLS // 1000), measure(
+        call_thunk, thunk, CALLS, repeat=options.repeat, memory=False)
+    yield "%dk calls function" % (CALLS // 1000), measure(
+        call_thunk, lambda: 4950, CALLS, repeat=options.repeat,
+        memory=False)
+    yield "%dk lazy created, called twice" % (THUNKS // 1000), measure(
+        create_thunks, THUNKS, repeat=options.repeat, memory=False)
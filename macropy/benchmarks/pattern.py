@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Throughput of ``macropy.experimental.pattern``: an interpreter and
+a simplifier of arithmetic expressions built from case classes, written
+with ``switch`` and by hand with ``isinstance`` checks, and single
+destructuring matches."""
+
+import random
+import sys
+
+from macropy.case_classes import macros, case
+from macropy.experimental.pattern import (  # noqa: F811
+    macros, switch, _matching)
+
+from . import measure
+
+
+COUNT = 20000
+
+
+@case
+class Expr:
+    class Num(n):  # noqa: F821
+        pass
+
+    class Var(name):  # noqa: F821
+        pass
+
+    class Neg(operand):  # noqa: F821
+        pass
+
+    class Add(left, right):  # noqa: F821
+        pass
+
+    class Mul(left, right):  # noqa: F821
+        pass
+
+    class Let(name, value, body):  # noqa: F821
+        pass
+
+
+Num, Var, Neg, Add, Mul, Let = (Expr.Num, Expr.Var, Expr.Neg, Expr.Add,
+                                Expr.Mul, Expr.Let)
+
+
+def evaluate(expr, env):
+    with switch(expr):
+        if Num(n):
+            return n
+        elif Var(name):
+            return env[name]
+        elif Neg(operand):
+            return -evaluate(operand, env)
+        elif Add(left, right):
+            return evaluate(left, env) + evaluate(right, env)
+        elif Mul(Num(0), right):
+            return 0
+        elif Mul(left, right):
+            return evaluate(left, env) * evaluate(right, env)
+        elif Let(name, value, body):
+            inner = dict(env)
+            inner[name] = evaluate(value, env)
+            return evaluate(body, inner)
+
+
+def evaluate_by_hand(expr, env):
+    if isinstance(expr, Num):
+        return expr.n
+    elif isinstance(expr, Var):
+        return env[expr.name]
+    elif isinstance(expr, Neg):
+        return -evaluate_by_hand(expr.operand, env)
+    elif isinstance(expr, Add):
+        return evaluate_by_hand(expr.left, env) + \
+            evaluate_by_hand(expr.right, env)
+    elif isinstance(expr, Mul) and isinstance(expr.left, Num) and \
+            expr.left.n == 0:
+        return 0
+    elif isinstance(expr, Mul):
+        return evaluate_by_hand(expr.left, env) * \
+            evaluate_by_hand(expr.right, env)
+    elif isinstance(expr, Let):
+        inner = dict(env)
+        inner[expr.name] = evaluate_by_hand(expr.value, env)
+        return evaluate_by_hand(expr.body, inner)
+
+
+def simplify(expr):
+    with switch(expr):
+        if Add(Num(0), other):
+            return simplify(other)
+        elif Add(other, Num(0)):
+            return simplify(other)
+        elif Mul(Num(0), _):
+            return Num(0)
+        elif Mul(_, Num(0)):
+            return Num(0)
+        elif Mul(Num(1), other):
+            return simplify(other)
+        elif Mul(other, Num(1)):
+            return simplify(other)
+        elif Neg(Neg(other)):
+            return simplify(other)
+        elif Neg(Num(n)):
+            return Num(-n)
+        elif Add(left, right):
+            return Add(simplify(left), simplify(right))
+        elif Mul(left, right):
+            return Mul(simplify(left), simplify(right))
+        elif Neg(operand):
+            return Neg(simplify(operand))
+        elif Let(name, value, body):
+            return Let(name, simplify(value), simplify(body))
+        else:
+            return expr
+
+
+def simplify_by_hand(expr):
+    if isinstance(expr, Add):
+        if isinstance(expr.left, Num) and expr.left.n == 0:
+            return simplify_by_hand(expr.right)
+        if isinstance(expr.right, Num) and expr.right.n == 0:
+            return simplify_by_hand(expr.left)
+        return Add(simplify_by_hand(expr.left), simplify_by_hand(expr.right))
+    elif isinstance(expr, Mul):
+        if isinstance(expr.left, Num) and expr.left.n == 0 or \
+                isinstance(expr.right, Num) and expr.right.n == 0:
+            return Num(0)
+        if isinstance(expr.left, Num) and expr.left.n == 1:
+            return simplify_by_hand(expr.right)
+        if isinstance(expr.right, Num) and expr.right.n == 1:
+            return simplify_by_hand(expr.left)
+        return Mul(simplify_by_hand(expr.left), simplify_by_hand(expr.right))
+    elif isinstance(expr, Neg):
+        if isinstance(expr.operand, Neg):
+            return simplify_by_hand(expr.operand.operand)
+        if isinstance(expr.operand, Num):
+            return Num(-expr.operand.n)
+        return Neg(simplify_by_hand(expr.operand))
+    elif isinstance(expr, Let):
+        return Let(expr.name, simplify_by_hand(expr.value),
+                   simplify_by_hand(expr.body))
+    return expr
+
+
+def generate_expr(count, seed=0):
+    """A random expression of about `count` nodes over the variables
+    ``a`` and ``b``"""
+    rnd = random.Random(seed)
+
+    def build(count, names):
+        if count <= 1:
+            if rnd.random() < 0.5:
+                return Var(rnd.choice(names))
+            return Num(rnd.randint(0, 9))
+        kind = rnd.random()
+        if kind < 0.1:
+            return Neg(build(count - 1, names))
+        if kind < 0.12:
+            name = "v%d" % len(names)
+            value = build(count // 2, names)
+            return Let(name, value, build(count - count // 2 - 1,
+                                          names + [name]))
+        left = rnd.randint(1, count - 1)
+        node = Add if kind < 0.6 else Mul
+        return node(build(left, names), build(count - left, names))
+
+    return build(count, ["a", "b"])
+
+
+def destructure(points):
+    total = 0
+    for point in points:
+        with _matching:
+            Num(n) << point
+        total += n
+    return total
+
+
+def destructure_by_hand(points):
+    total = 0
+    for point in points:
+        if not isinstance(point, Num):
+            raise TypeError(point)
+        total += point.n
+    return total
+
+
+def run(options):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+    expr = generate_expr(COUNT)
+    env = {"a": 3, "b": -2}
+    assert evaluate(expr, env) == evaluate_by_hand(expr, env)
+
+    name = "evaluate %dk nodes" % (COUNT // 1000)
+    yield name + " switch", measure(evaluate, expr, env,
+                                    repeat=options.repeat, memory=False)
+    yield name + " by hand", measure(evaluate_by_hand, expr, env,
+                                     repeat=options.repeat, memory=False)
+
+    assert simplify(expr) == simplify_by_hand(expr)
+    name = "simplify %dk nodes" % (COUNT // 1000)
+    yield name + " switch", measure(simplify, expr, repeat=options.repeat,
+                                    memory=False)
+    yield name + " by hand", measure(simplify_by_hand, expr,
+                                     repeat=options.repeat, memory=False)
+
+    numbers = [Num(i) for i in range(COUNT)]
+    name = "destructure %dk values" % (COUNT // 1000)
+    yield name + " _matching", measure(destructure, numbers,
+                                       repeat=options.repeat, memory=False)
+    yield name + " by hand", measure(destructure_by_hand, numbers,
+                                     repeat=options.repeat, memory=False)
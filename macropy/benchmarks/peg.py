@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""Throughput of ``macropy.peg`` grammars on generated inputs of growing
+size, and on the JSON_checker fixtures used by the tests."""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import multiprocessing
+import os
+import random
+import sys
+
+from macropy.peg import macros, peg, cut, ParseError
+from macropy.quick_lambda import macros, f, _  # noqa: F811
+
+from . import activate_worker, format_size, measure, measure_sizes
+
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                        'test', 'peg_json')
+
+NESTING_DEPTH = 64
+
+
+def decode(x):
+    return x.encode().decode('unicode-escape')
+
+
+escape_map = {
+    '"': '"',
+    '/': '/',
+    '\\': '\\',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t'
+}
+
+
+with peg:
+    json_doc = (space, (obj | array), space) // f[_[1]]
+    json_exp = (space, (obj | array | string | true | false | null |
+                        number), space) // f[_[1]]
+
+    pair = (string is k, space, ':', cut, json_exp is v) >> (k, v)
+    obj = ('{', cut, pair.rep_with(",") // dict, space, '}') // f[_[1]]
+    array = ('[', cut, json_exp.rep_with(","), space, ']') // f[_[1]]
+
+    string = (space, '"',
+              (r'[^"\\\t\n]'.r | escape | unicode_escape).rep.join is
+              body, '"') >> "".join(body)
+    escape = ('\\', ('"' | '/' | '\\' | 'b' | 'f' | 'n' | 'r' | 't') //
+              escape_map.get) // f[_[1]]
+    unicode_escape = ('\\', 'u', ('[0-9A-Fa-f]'.r * 4).join).join // decode
+
+    true = 'true' >> True
+    false = 'false' >> False
+    null = 'null' >> None
+
+    number = decimal | integer
+    integer = ('-'.opt, integral).join // int
+    decimal = ('-'.opt, integral,
+               ((fract, exp).join) | fract | exp).join // float
+
+    integral = '0' | '[1-9][0-9]*'.r
+    fract = ('.', '[0-9]+'.r).join
+    exp = (('e' | 'E'), ('+' | '-').opt, "[0-9]+".r).join
+
+    space = r'\s*'.r
+
+
+operators = {
+    '+': f[_ + _],
+    '-': f[_ - _],
+    '*': f[_ * _],
+    '/': f[_ / _],
+}
+
+
+def reduce_chain(first, rest):
+    for op, value in rest:
+        first = operators[op](first, value)
+    return first
+
+
+with peg:
+    record = (field.rep_with(",") is fields, "|", obj is payload) >> \
+        (fields, payload)
+    field = '[^,|\n]*'.r
+    newline = "\n"
+
+
+with peg:
+    expr = (term is first, (('+' | '-'), term).rep is rest) >> \
+        reduce_chain(first, rest)
+    term = (value is first, (('*' | '/'), value).rep is rest) >> \
+        reduce_chain(first, rest)
+    value = '[0-9]+'.r // int | ('(', expr, ')') // f[_[1]]
+
+
+def generate_json(size, seed=0):
+    """A JSON array of records at least `size` bytes long"""
+    rnd = random.Random(seed)
+    words = ["alpha", "beta", "gamma", "delta", "tab\there", 'quote"d',
+             "caf\u00e9", "x" * 20]
+    chunks = []
+    length = 2
+    while length < size:
+        record = json.dumps({
+            "id": rnd.randint(0, 10 ** 6),
+            "name": rnd.choice(words),
+            "score": round(rnd.uniform(-1000, 1000), 3),
+            "ratio": rnd.uniform(0, 1) * 10 ** rnd.randint(-20, 20),
+            "active": rnd.choice([True, False, None]),
+            "tags": [rnd.choice(words) for i in range(rnd.randint(0, 4))],
+            "nested": {"x": rnd.randint(-5, 5), "y": [1, 2.5, {"z": []}]},
+        })
+        chunks.append(record)
+        length += len(record) + 2
+    return "[" + ",\n ".join(chunks) + "]"
+
+
+def generate_nested(size, depth=NESTING_DEPTH):
+    """A JSON array of arrays nested `depth` deep, at least `size` bytes
+    long"""
+    block = "[" * depth + "1" + "]" * depth
+    return "[" + ",".join([block] * max(1, size // (len(block) + 1))) + "]"
+
+
+def generate_arithmetic(size, seed=0):
+    """An arithmetic expression at least `size` bytes long"""
+    rnd = random.Random(seed)
+
+    def term(depth):
+        factors = []
+        for i in range(rnd.randint(1, 3)):
+            if depth < 3 and rnd.random() < 0.3:
+                factors.append("(" + chain(depth + 1) + ")")
+            else:
+                factors.append(str(rnd.randint(1, 999)))
+        return "".join(factor + rnd.choice("*/")
+                       for factor in factors[:-1]) + factors[-1]
+
+    def chain(depth):
+        return "".join(term(depth) + rnd.choice("+-")
+                       for i in range(rnd.randint(1, 3))) + term(depth)
+
+    chunks = [chain(0)]
+    length = len(chunks[0])
+    while length < size:
+        chunks.append(chain(0))
+        length += len(chunks[-1]) + 1
+    return "+".join(chunks)
+
+
+def generate_records(size, seed=0):
+    """Newline separated records of comma separated fields followed by a
+    JSON payload, at least `size` bytes long"""
+    rnd = random.Random(seed)
+    lines = []
+    length = 0
+    while length < size:
+        fields = ["f%d" % rnd.randint(0, 999) for i in range(rnd.randint(1, 6))]
+        payload = json.dumps({"n": rnd.randint(0, 10 ** 6),
+                              "xs": [rnd.random() for i in range(3)]})
+        lines.append(",".join(fields) + "|" + payload)
+        length += len(lines[-1]) + 1
+    return "\n".join(lines) + "\n"
+
+
+def parse_failing(parser, strings):
+    for string in strings:
+        try:
+            parser.parse(string)
+        except ParseError:
+            pass
+
+
+def parse_json(string):
+    return json_exp.parse(string)
+
+
+def read_fixtures(prefix):
+    names = sorted(n for n in os.listdir(FIXTURES) if n.startswith(prefix))
+    # fail18.json is only invalid because of its nesting depth
+    names = [n for n in names if n != 'fail18.json']
+    strings = []
+    for name in names:
+        with open(os.path.join(FIXTURES, name)) as fixture:
+            strings.append(fixture.read())
+    return strings
+
+
+def run(options):
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 20000))
+
+    for string in read_fixtures('pass'):
+        assert json_exp.parse(string) == json.loads(string)
+    passing = read_fixtures('pass')
+    yield "json fixtures pass*.json", measure(
+        lambda: [json_exp.parse(s) for s in passing],
+        repeat=options.repeat, nbytes=sum(map(len, passing)))
+    failing = read_fixtures('fail')
+    yield "json fixtures fail*.json", measure(
+        lambda: parse_failing(json_doc, failing),
+        repeat=options.repeat, nbytes=sum(map(len, failing)))
+
+    yield from measure_sizes(options, "json records", generate_json,
+                             json_exp.parse)
+    yield from measure_sizes(options, "json nested %d deep" % NESTING_DEPTH,
+                             generate_nested, json_exp.parse)
+    yield from measure_sizes(options, "arithmetic", generate_arithmetic,
+                             expr.parse)
+    yield from run_concurrent(options)
+
+
+def run_concurrent(options, count=16, size=8 * 1024):
+    """Parses `count` documents with one shared grammar, sequentially and
+    spread over pools of threads, which can only scale on builds without
+    the GIL, and of processes."""
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print("GIL enabled: %s" % ("yes" if gil else "no"))
+    documents = [generate_json(size, seed=i) for i in range(count)]
+    nbytes = sum(map(len, documents))
+    name = "json %dx%s" % (count, size // 1024) + "KB"
+
+    yield name + " sequential", measure(
+        lambda: list(map(parse_json, documents)),
+        repeat=options.repeat, nbytes=nbytes, memory=False)
+    for workers in (2, 4):
+        with ThreadPoolExecutor(workers) as pool:
+            yield name + " %d threads" % workers, measure(
+                lambda: list(pool.map(parse_json, documents)),
+                repeat=options.repeat, nbytes=nbytes, memory=False)
+        with multiprocessing.Pool(workers, activate_worker) as pool:
+            yield name + " %d processes" % workers, measure(
+                lambda: pool.map(parse_json, documents, 1),
+                repeat=options.repeat, nbytes=nbytes, memory=False)
+    yield from run_many(options)
+
+
+def run_many(options, size=256 * 1024):
+    """parse_many over newline separated records, on pools of processes"""
+    text = generate_records(size)
+    for processes in (1, 2, 4):
+        yield "records %s parse_many %d processes" % (
+            format_size(size), processes), measure(
+            record.parse_many, text, newline, processes, 16 * 1024,
+            repeat=options.repeat, nbytes=len(text), memory=False)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Cost of running the same ``query`` and building the same ``sql``
+statement over and over with other values, as request handlers do,
+next to building the statement by hand with SQLAlchemy each time, and
+the memory used to go through a large result with ``query``,
+``stream`` and ``columns``, on an in-memory SQLite database. Also the
+startup cost of ``generate_schema`` with many tables, reflected, loaded
+from its cache or reflected lazily."""
+
+import shutil
+import tempfile
+
+import sqlalchemy
+from sqlalchemy import create_engine
+
+from macropy.experimental.pinq import (
+    macros, sql, query, stream, columns, generate_schema)
+
+from . import measure
+
+
+COUNT = 2000
+ROWS = 1000
+LARGE_ROWS = 200000
+TABLES = 100
+
+
+def create_db(rows):
+    engine = create_engine("sqlite://")
+    engine.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, "
+                   "customer VARCHAR(10), amount INTEGER)")
+    engine.execute("INSERT INTO orders (customer, amount) VALUES (?, ?)",
+                   [("c%d" % (i % 50), i % 100) for i in range(rows)])
+    return generate_schema(engine)
+
+
+def order_ids(db, customer, amount):
+    return query[(o.id for o in db.orders
+                  if o.customer == customer if o.amount > amount)]
+
+
+def order_ids_by_hand(db, customer, amount):
+    orders = db.orders.alias()
+    statement = sqlalchemy.select([orders.c.id]).where(
+        orders.c.customer == customer).where(orders.c.amount > amount)
+    return statement.bind.execute(statement).fetchall()
+
+
+def order_statement(db, customer, amount):
+    return sql[(o.id for o in db.orders
+                if o.customer == customer if o.amount > amount)]
+
+
+def order_statement_by_hand(db, customer, amount):
+    orders = db.orders.alias()
+    return sqlalchemy.select([orders.c.id]).where(
+        orders.c.customer == customer).where(orders.c.amount > amount)
+
+
+def total_amount(db):
+    return sum(amount for _, amount in query[
+        ((o.customer, o.amount) for o in db.orders if o.amount >= 0)])
+
+
+def total_amount_stream(db):
+    return sum(amount for _, amount in stream[
+        ((o.customer, o.amount) for o in db.orders if o.amount >= 0)])
+
+
+def total_amount_columns(db):
+    customers, amounts = columns[
+        ((o.customer, o.amount) for o in db.orders if o.amount >= 0)]
+    return sum(amounts)
+
+
+def create_tables(count):
+    engine = create_engine("sqlite://")
+    for i in range(count):
+        engine.execute("CREATE TABLE t%d (id INTEGER PRIMARY KEY, "
+                       "name VARCHAR(10), value FLOAT)" % i)
+    return engine
+
+
+def first_table(engine, cache_dir=None, lazy=False):
+    return generate_schema(engine, cache_dir, lazy=lazy).t0
+
+
+def run_queries(func, db, count):
+    for i in range(count):
+        func(db, "c%d" % (i % 50), i % 100)
+
+
+def run(options):
+    db = create_db(ROWS)
+    assert order_ids(db, "c1", 50) == order_ids_by_hand(db, "c1", 50)
+
+    name = "%d queries" % COUNT
+    yield name + " query", measure(
+        run_queries, order_ids, db, COUNT, repeat=options.repeat,
+        memory=False)
+    yield name + " by hand", measure(
+        run_queries, order_ids_by_hand, db, COUNT, repeat=options.repeat,
+        memory=False)
+    name = "%d statements" % COUNT
+    yield name + " sql", measure(
+        run_queries, order_statement, db, COUNT, repeat=options.repeat,
+        memory=False)
+    yield name + " by hand", measure(
+        run_queries, order_statement_by_hand, db, COUNT,
+        repeat=options.repeat, memory=False)
+
+    db = create_db(LARGE_ROWS)
+    name = "sum of %dk rows" % (LARGE_ROWS // 1000)
+    yield name + " query", measure(total_amount, db, repeat=options.repeat)
+    yield name + " stream", measure(total_amount_stream, db,
+                                    repeat=options.repeat)
+    yield name + " columns", measure(total_amount_columns, db,
+                                     repeat=options.repeat)
+
+    engine = create_tables(TABLES)
+    cache_dir = tempfile.mkdtemp()
+    try:
+        name = "schema of %d tables" % TABLES
+        yield name + " reflected", measure(
+            first_table, engine, repeat=options.repeat, memory=False)
+        first_table(engine, cache_dir)
+        yield name + " cached", measure(
+            first_table, engine, cache_dir, repeat=options.repeat,
+            memory=False)
+        yield name + " lazy", measure(
+            first_table, engine, None, True, repeat=options.repeat,
+            memory=False)
+    finally:
+        shutil.rmtree(cache_dir)
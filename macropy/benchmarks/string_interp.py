@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Cost of evaluating ``s[...]`` strings, as in a logging hot path,
+next to the same messages written by hand with ``%`` and a tuple."""
+
+from macropy.string_interp import macros, s
+
+from . import measure
+
+
+COUNT = 1000000
+
+
+def log_lines(count):
+    user, items = "alice", 3
+    for i in range(count):
+        s["user {user} bought {items} items, order {i}"]
+
+
+def log_lines_by_hand(count):
+    user, items = "alice", 3
+    for i in range(count):
+        "user %s bought %s items, order %s" % (user, items, i)
+
+
+def constant_lines(count):
+    for i in range(count):
+        s["request {'GET'} done in {0} retries"]
+
+
+def run(options):
+    name = "%dk messages" % (COUNT // 1000)
+    yield name + " s", measure(log_lines, COUNT, repeat=options.repeat,
+                               memory=False)
+    yield name + " by hand", measure(log_lines_by_hand, COUNT,
+                                     repeat=options.repeat, memory=False)
+    yield name + " constant s", measure(constant_lines, COUNT,
+                                        repeat=options.repeat, memory=False)
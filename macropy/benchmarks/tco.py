@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Cost of the tail calls of ``@tco`` functions recursing a million
+times, directly and mutually, next to the same loops written with
+``while``, and the same for ``@tco async def`` functions awaiting
+their tail calls in an asyncio event loop."""
+
+import asyncio
+
+from macropy.experimental.tco import macros, tco
+
+from . import measure
+
+
+DEPTH = 1000000
+
+
+@tco
+def count_down(n, total=0):
+    if n == 0:
+        return total
+    return count_down(n - 1, total + n)
+
+
+def count_down_by_hand(n, total=0):
+    while n != 0:
+        n, total = n - 1, total + n
+    return total
+
+
+@tco
+def collatz_steps(n, steps):
+    if n == 1:
+        return steps
+    elif n % 2 == 0:
+        return collatz_steps(n // 2, steps + 1)
+    else:
+        return collatz_steps(3 * n + 1, steps + 1)
+
+
+@tco
+def is_even(n):
+    if n == 0:
+        return True
+    return is_odd(n - 1)
+
+
+@tco
+def is_odd(n):
+    if n == 0:
+        return False
+    return is_even(n - 1)
+
+
+@tco
+async def async_count_down(n, total=0):
+    if n == 0:
+        return total
+    return await async_count_down(n - 1, total + n)
+
+
+async def async_count_down_by_hand(n, total=0):
+    while n != 0:
+        n, total = n - 1, total + n
+    return total
+
+
+@tco
+async def async_is_even(n):
+    if n == 0:
+        return True
+    return await async_is_odd(n - 1)
+
+
+@tco
+async def async_is_odd(n):
+    if n == 0:
+        return False
+    return await async_is_even(n - 1)
+
+
+async def plain_is_even(n):
+    if n == 0:
+        return True
+    return await plain_is_odd(n - 1)
+
+
+async def plain_is_odd(n):
+    if n == 0:
+        return False
+    return await plain_is_even(n - 1)
+
+
+def longest_collatz(limit):
+    return max(collatz_steps(n, 0) for n in range(1, limit))
+
+
+def run(options):
+    assert count_down(DEPTH) == count_down_by_hand(DEPTH)
+    name = "%dk calls" % (DEPTH // 1000)
+    yield name + " self-recursion", measure(
+        count_down, DEPTH, repeat=options.repeat, memory=False)
+    yield name + " while loop", measure(
+        count_down_by_hand, DEPTH, repeat=options.repeat, memory=False)
+    yield "collatz below 10000", measure(
+        longest_collatz, 10000, repeat=options.repeat, memory=False)
+    yield name + " mutual recursion", measure(
+        is_even, DEPTH, repeat=options.repeat, memory=False)
+
+    loop = asyncio.new_event_loop()
+    try:
+        def run_async(func, n):
+            return loop.run_until_complete(func(n))
+
+        yield name + " async self-recursion", measure(
+            run_async, async_count_down, DEPTH, repeat=options.repeat,
+            memory=False)
+        yield name + " async while loop", measure(
+            run_async, async_count_down_by_hand, DEPTH,
+            repeat=options.repeat, memory=False)
+        yield name + " async mutual recursion", measure(
+            run_async, async_is_even, DEPTH, repeat=options.repeat,
+            memory=False)
+        # without @tco the recursion must stay below the recursion limit
+        yield "500 calls async mutual recursion", measure(
+            run_async, async_is_even, 500, repeat=options.repeat,
+            memory=False)
+        yield "500 calls async plain recursion", measure(
+            run_async, plain_is_even, 500, repeat=options.repeat,
+            memory=False)
+    finally:
+        loop.close()
@@ -1,13 +1,19 @@
 """Macro providing an extremely concise way of declaring classes"""
 
+from array import array
 import ast
-
-from .core import parse_stmt, unparse, ast_repr  # noqa: F401
+import copyreg
+from itertools import accumulate
+from operator import attrgetter
+import pickle
+import struct
+import sys
+
+from .core import compat, unparse, ast_repr  # noqa: F401
+from .core.analysis import extract_arg_names
 from .core.macros import Macros
-from .core.walkers import Walker
 from .core.hquotes import macros, hq, unhygienic, u
 from .core.quotes import ast_literal, name
-from .core.analysis import Scoped
 
 
 macros = Macros()  # noqa: F811
@@ -17,9 +23,51 @@ def apply(f):
     return f()
 
 
-class CaseClass(object):
+# bypasses FrozenCaseClass.__setattr__ in generated code
+set_field = object.__setattr__
+
+
+def field_getter(fields):
+    """A function returning the tuple of the `fields` of an object"""
+    if len(fields) > 1:
+        return attrgetter(*fields)
+    elif fields:
+        get = attrgetter(fields[0])
+        return lambda obj: (get(obj),)
+    return lambda obj: ()
+
+
+class CaseClassType(type):
+    """Gives each case class what the methods of `CaseClass` need: the
+    ``_values`` function returning the tuple of the fields of an
+    instance, the ``_template`` showing them, the ``_state_names`` of
+    the members which are not arguments of the constructor, and
+    ``_custom_init``, true if its ``__init__`` is not the generated
+    one"""
+
+    def __init__(cls, name, bases, namespace):
+        super(CaseClassType, cls).__init__(name, bases, namespace)
+        if '_fields' not in namespace:
+            return
+        cls._values = staticmethod(field_getter(cls._fields))
+        cls._template = "%s(" + ", ".join(["%s"] * len(cls._fields)) + ")"
+        cls._custom_init = namespace.get('_custom_init', False)
+        arguments = record_columns(cls)
+        names = []
+        for base in reversed(cls.__mro__):
+            for slot in base.__dict__.get('__slots__', ()):
+                if slot not in names and slot not in arguments and \
+                   slot != '_hash':
+                    names.append(slot)
+        cls._state_names = tuple(names)
+
+
+class CaseClass(object, metaclass=CaseClassType):
+    """Base of the case classes, whose methods read the fields through
+    the ``_values`` function of their class"""
 
     __slots__ = []
+    _custom_init = False
 
     def copy(self, **kwargs):
         old = list(map(lambda a: (a, getattr(self, a)), self._fields))
@@ -27,34 +75,118 @@ class CaseClass(object):
         return self.__class__(**dict(old + new))
 
     def __str__(self):
-        return (self.__class__.__name__ + "(" +
-                ", ".join(str(getattr(self, x))
-                          for x in self.__class__._fields) + ")")
+        return self._template % ((self.__class__.__name__,) +
+                                 self._values(self))
 
     def __repr__(self):
         return self.__str__()
 
     def __eq__(self, other):
         try:
-            return self.__class__ == other.__class__ \
-                and all(getattr(self, x) == getattr(other, x)
-                        for x in self.__class__._fields)
+            values = self._values
+            return (self.__class__ is other.__class__ and
+                    values(self) == values(other))
         except AttributeError:
             return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self._values(self))
+
     def __iter__(self):
-        for x in self.__class__._fields:
-            yield getattr(self, x)
+        return iter(self._values(self))
+
+    def __getnewargs__(self):
+        args = self._values(self)
+        if self._varargs:
+            args += tuple(getattr(self, self._varargs))
+        return args
+
+    def __reduce__(self):
+        cls = self.__class__
+        if cls._custom_init:
+            # the arguments of __init__ are not the fields: rebuild the
+            # instance without calling it, like the default __reduce__
+            return (copyreg.__newobj__, (cls,) + self.__getnewargs__(),
+                    slot_state(self, record_columns(cls) +
+                               list(cls._state_names)))
+        if cls._kwargs:
+            reduced = (construct, (cls, self.__getnewargs__(),
+                                   getattr(self, cls._kwargs)))
+        else:
+            reduced = (cls, self.__getnewargs__())
+        state = slot_state(self, cls._state_names)
+        return reduced + (state,) if state else reduced
+
+
+class FrozenCaseClass(CaseClass):
+    """Base of the case classes declared with `frozen`, whose instances
+    cannot be modified after their ``__init__`` and cache their hash"""
+
+    __slots__ = ['_hash']
+
+    def __setattr__(self, name, value):
+        try:
+            self._hash
+        except AttributeError:
+            object.__setattr__(self, name, value)
+        else:
+            raise AttributeError("can't set attribute %r of frozen %s" %
+                                 (name, self.__class__.__name__))
+
+    def __delattr__(self, name):
+        raise AttributeError("can't delete attribute %r of frozen %s" %
+                             (name, self.__class__.__name__))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        try:
+            if self.__class__ is not other.__class__:
+                return False
+            h, other_h = self._hash, other._hash
+            if h is not None and other_h is not None and h != other_h:
+                return False
+            values = self._values
+            return values(self) == values(other)
+        except AttributeError:
+            return False
+
+    def __hash__(self):
+        h = self._hash
+        if h is None:
+            h = hash(self._values(self))
+            object.__setattr__(self, '_hash', h)
+        return h
+
+    def __setstate__(self, state):
+        # the cached hash is left out, as it may differ between processes
+        if type(state) is not tuple:
+            state = (state, None)
+        for part in state:
+            for k, v in (part or {}).items():
+                if k != '_hash':
+                    object.__setattr__(self, k, v)
+        object.__setattr__(self, '_hash', None)
+
+    def copy(self, **kwargs):
+        """Shares the whole instance if no field is changed, and the
+        values of the unchanged fields otherwise"""
+        missing = object()
+        for k, v in kwargs.items():
+            if getattr(self, k, missing) is not v:
+                return CaseClass.copy(self, **kwargs)
+        return self
+
+    def __copy__(self):
+        return self
 
 
 class Enum(object):
 
     def __new__(cls, *args, **kw):
-        if not hasattr(cls, "all"):
-            cls.all = []
         thing = super(Enum, cls).__new__(cls)
         cls.all.append(thing)
         return thing
@@ -84,6 +216,18 @@ def enum_new(cls, **kw):
 
     [(k, v)] = kw.items()
 
+    index = cls._indexes.get(k)
+    if index is not None:
+        try:
+            return index[v]
+        except KeyError:
+            raise ValueError("No Enum found for %s=%s" % (k, v))
+        except TypeError:
+            pass
+    elif k in cls._ambiguous:
+        raise ValueError("Cannot select a %s by %s, which is not unique: "
+                         "%s" % (cls.__name__, k, cls._ambiguous[k]))
+
     for value in cls.all:
         if getattr(value, k) == v:
             return value
@@ -91,10 +235,392 @@ def enum_new(cls, **kw):
     raise ValueError("No Enum found for %s=%s" % (k, v))
 
 
+def index_enum(cls):
+    """Builds the dicts selecting the instances of an Enum by each of its
+    fields, keeping aside the fields whose values are not unique and
+    falling back on a scan for those which are not hashable"""
+    cls._indexes = {}
+    cls._ambiguous = {}
+    for field in cls._fields:
+        index = {}
+        try:
+            for value in cls.all:
+                key = getattr(value, field)
+                if key in index:
+                    cls._ambiguous[field] = "%s and %s have %s=%r" % (
+                        index[key], value, field, key)
+                    break
+                index[key] = value
+            else:
+                cls._indexes[field] = index
+        except TypeError:
+            pass
+
+
 def noop_init(*args, **kw):
     pass
 
 
+def construct(cls, args, kwargs):
+    """Rebuilds a pickled case class which takes **kwargs"""
+    return cls(*args, **kwargs)
+
+
+def slot_state(obj, names):
+    """The pickle state of the members `names` of `obj`, or None if none
+    of them is set"""
+    state = {}
+    for name in names:
+        try:
+            state[name] = getattr(obj, name)
+        except AttributeError:
+            pass
+    return (None, state) if state else None
+
+
+RECORDS_MAGIC = b'MPYR\x01'
+
+
+def pack_column(values):
+    """-> (kind, bytes), storing ints, floats, bools and strings as flat
+    arrays of the smallest fitting type and anything else as a pickled
+    list. Strings with many repeats are stored once, with an array of
+    indexes into them."""
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        low, high = min(values), max(values)
+        for code in 'bhiq':
+            bound = 1 << (8 * array(code).itemsize - 1)
+            if -bound <= low and high < bound:
+                return code.encode(), array(code, values).tobytes()
+    elif kinds == {float}:
+        return b'd', array('d', values).tobytes()
+    elif kinds == {bool}:
+        return b'?', array('b', values).tobytes()
+    elif kinds == {str}:
+        unique = list(dict.fromkeys(values))
+        kind = None
+        if len(unique) * 2 <= len(values):
+            kind, strings = pack_column(unique)
+        if kind == b's':
+            index = {v: i for i, v in enumerate(unique)}
+            kind, indexes = pack_column(list(map(index.__getitem__, values)))
+            return b'S', (struct.pack('<QQ', len(unique), len(strings)) +
+                          strings + kind + indexes)
+        try:
+            encoded = [v.encode('utf-8') for v in values]
+            return b's', (array('q', map(len, encoded)).tobytes() +
+                          b''.join(encoded))
+        except UnicodeEncodeError:
+            pass
+    return b'o', pickle.dumps(list(values), pickle.HIGHEST_PROTOCOL)
+
+
+def unpack_column(kind, data, count, swap):
+    if kind == b'o':
+        return pickle.loads(data)
+    if kind == b'S':
+        unique, size = struct.unpack_from('<QQ', data)
+        start = struct.calcsize('<QQ')
+        strings = unpack_column(b's', data[start:start + size], unique, swap)
+        start += size
+        indexes = unpack_column(data[start:start + 1], data[start + 1:],
+                                count, swap)
+        return list(map(strings.__getitem__, indexes))
+    code = {b'd': 'd', b'?': 'b', b's': 'q'}.get(kind, kind.decode())
+    items = array(code)
+    items.frombytes(data[:count * items.itemsize] if kind == b's' else data)
+    if swap:
+        items.byteswap()
+    if kind == b'?':
+        return list(map(bool, items))
+    if kind != b's':
+        return items.tolist()
+    blob = data[count * items.itemsize:]
+    text = blob.decode('utf-8')
+    ends = list(accumulate(items))
+    starts = [0] + ends[:-1]
+    if len(text) == len(blob):
+        # only one byte characters: the byte offsets are character offsets
+        return list(map(text.__getitem__, map(slice, starts, ends)))
+    return [blob[a:b].decode('utf-8') for a, b in zip(starts, ends)]
+
+
+def pack_records(records):
+    """Encodes a sequence of instances of one case class into a compact
+    columnar bytes string, read back with `unpack_records`.
+
+    Each field becomes a column; columns of ints, floats, bools or strings
+    are stored as flat arrays, others are pickled as lists. The class
+    itself is pickled by reference. Unlike pickle, equal values are not
+    shared between records, except for repeated strings."""
+    records = list(records)
+    cls = type(records[0]) if records else None
+    if any(type(r) is not cls for r in records):
+        raise TypeError("pack_records needs instances of a single class")
+    names = record_columns(cls) if records else []
+    if len(names) == 1:
+        columns = [list(map(attrgetter(names[0]), records))]
+    elif names:
+        columns = list(zip(*map(attrgetter(*names), records))) or \
+            [()] * len(names)
+    else:
+        columns = []
+
+    class_ref = pickle.dumps(cls, pickle.HIGHEST_PROTOCOL)
+    parts = [RECORDS_MAGIC, sys.byteorder[0].encode(),
+             struct.pack('<IQH', len(class_ref), len(records), len(columns)),
+             class_ref]
+    for values in columns:
+        kind, data = pack_column(values)
+        parts.extend([kind, struct.pack('<Q', len(data)), data])
+    return b''.join(parts)
+
+
+def unpack_records(data):
+    """Decodes a bytes string made by `pack_records`, calling the
+    constructor of the case class for each record"""
+    if not data.startswith(RECORDS_MAGIC):
+        raise ValueError("not a string made by pack_records")
+    data = memoryview(data)
+    pos = len(RECORDS_MAGIC)
+    swap = bytes(data[pos:pos + 1]) != sys.byteorder[0].encode()
+    class_len, count, ncolumns = struct.unpack_from('<IQH', data, pos + 1)
+    pos += 1 + struct.calcsize('<IQH')
+    cls = pickle.loads(data[pos:pos + class_len])
+    pos += class_len
+    columns = []
+    for i in range(ncolumns):
+        kind = bytes(data[pos:pos + 1])
+        size, = struct.unpack_from('<Q', data, pos + 1)
+        pos += 9
+        columns.append(unpack_column(kind, bytes(data[pos:pos + size]),
+                                     count, swap))
+        pos += size
+
+    if cls is None:
+        return []
+    return build_records(cls, columns, count)
+
+
+def record_columns(cls):
+    """The names of the arguments of a case class, in the order of its
+    constructor"""
+    return list(cls._fields) + [n for n in (cls._varargs, cls._kwargs) if n]
+
+
+def build_records(cls, columns, count):
+    """Calls the constructor of `cls` with the values of each row of
+    `columns`, ordered like `record_columns(cls)`"""
+    if not (cls._varargs or cls._kwargs) and columns:
+        return list(map(cls, *columns))
+    nfields = len(cls._fields)
+    records = []
+    for row in (zip(*columns) if columns else [()] * count):
+        args = row[:nfields]
+        if cls._varargs:
+            args += tuple(row[nfields])
+        records.append(cls(*args, **(row[-1] if cls._kwargs else {})))
+    return records
+
+
+def make_column(values):
+    """An array of int64 or float for values all of one of these types,
+    else a list"""
+    values = list(values)
+    kinds = set(map(type, values))
+    if kinds == {int}:
+        try:
+            return array('q', values)
+        except OverflowError:
+            pass
+    elif kinds == {float}:
+        return array('d', values)
+    return values
+
+
+COLUMN_TYPES = {'q': int, 'd': float}
+
+
+class BatchView(object):
+    """A record of a Batch, reading its fields from the columns"""
+
+    __slots__ = ['_columns', '_index']
+
+    def __init__(self, columns, index):
+        self._columns = columns
+        self._index = index
+
+    def __iter__(self):
+        for column in self._columns[:len(self._batch.record._fields)]:
+            yield column[self._index]
+
+    def __repr__(self):
+        return "%s(%s)" % (self._batch.record.__name__,
+                           ", ".join(map(str, self)))
+
+    def instance(self):
+        """A new instance of the case class with the values of this
+        record"""
+        index = self._index
+        return build_records(self._batch.record,
+                             [[column[index]] for column in self._columns],
+                             1)[0]
+
+
+class Batch(object):
+    """A sequence of records of one case class, stored as one column per
+    argument of its constructor: an ``array.array`` for ints and floats,
+    a list otherwise. Available as ``Cls.Batch`` for each case class.
+
+    Indexing and iterating give `BatchView` objects reading the columns
+    in place; a slice gives a new Batch."""
+
+    record = None
+
+    def __init__(self, records=()):
+        records = list(records)
+        for r in records:
+            if type(r) is not self.record:
+                raise TypeError("%s cannot hold %r" % (self._name(), r))
+        getters = [attrgetter(n) for n in record_columns(self.record)]
+        self.columns = [make_column(map(get, records)) for get in getters]
+        self._length = len(records)
+
+    @classmethod
+    def from_columns(cls, **columns):
+        """Builds a Batch from one sequence of values per argument of the
+        constructor of the case class"""
+        names = record_columns(cls.record)
+        if set(columns) != set(names):
+            raise TypeError("%s needs the columns %s" % (
+                cls._name(), ", ".join(names)))
+        lengths = set(map(len, columns.values()))
+        if len(lengths) > 1:
+            raise ValueError("columns of different lengths")
+        return cls._make([make_column(columns[n]) for n in names],
+                         lengths.pop() if lengths else 0)
+
+    @classmethod
+    def _make(cls, columns, length):
+        batch = cls.__new__(cls)
+        batch.columns = columns
+        batch._length = length
+        return batch
+
+    @classmethod
+    def _name(cls):
+        return cls.record.__name__ + ".Batch"
+
+    def column(self, name):
+        """The column of the field `name`, which may be an array"""
+        return self.columns[self._positions[name]]
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        view, columns = self.View, self.columns
+        for i in range(self._length):
+            yield view(columns, i)
+
+    def __getitem__(self, index):
+        if type(index) is slice:
+            return self._make([c[index] for c in self.columns],
+                              len(range(*index.indices(self._length))))
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("%s index out of range" % self._name())
+        return self.View(self.columns, index)
+
+    def __repr__(self):
+        return "%s(%d records)" % (self._name(), self._length)
+
+    def append(self, record):
+        if type(record) is not self.record:
+            raise TypeError("%s cannot hold %r" % (self._name(), record))
+        for i, name in enumerate(record_columns(self.record)):
+            self._append_value(i, getattr(record, name))
+        self._length += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def _append_value(self, i, value):
+        column = self.columns[i]
+        if type(column) is array:
+            if type(value) is COLUMN_TYPES[column.typecode]:
+                try:
+                    column.append(value)
+                    return
+                except OverflowError:
+                    pass
+            # turned into a list in place, for the views to see it
+            column = self.columns[i] = column.tolist()
+        column.append(value)
+
+    def copy(self, **updates):
+        """A new Batch with the columns named in `updates` replaced,
+        either by a single value for all the records or by a sequence of
+        values, and copies of the other columns"""
+        columns = [c[:] for c in self.columns]
+        for name, values in updates.items():
+            if name not in self._positions:
+                raise TypeError("%s has no field %r" % (self._name(), name))
+            if type(values) is str or not hasattr(values, '__len__'):
+                values = [values] * self._length
+            elif len(values) != self._length:
+                raise ValueError("%d values for %d records" % (
+                    len(values), self._length))
+            columns[self._positions[name]] = make_column(values)
+        return self._make(columns, self._length)
+
+    def filter(self, predicate):
+        """A new Batch of the records for which `predicate(view)` is true,
+        or of those where a sequence of booleans of the same length is
+        true"""
+        if callable(predicate):
+            predicate = map(predicate, self)
+        indexes = [i for i, keep in enumerate(predicate) if keep]
+        columns = []
+        for c in self.columns:
+            values = map(c.__getitem__, indexes)
+            columns.append(array(c.typecode, values)
+                           if type(c) is array else list(values))
+        return self._make(columns, len(indexes))
+
+    def to_instances(self):
+        """A list of new instances of the case class"""
+        return build_records(self.record, self.columns, self._length)
+
+
+class BatchProperty(object):
+    """Makes ``Cls.Batch`` a subclass of Batch holding instances of
+    ``Cls``, created the first time it is used"""
+
+    def __get__(self, obj, cls):
+        batch = cls.__dict__.get('_batch_class')
+        if batch is None:
+            names = record_columns(cls)
+            view = type(cls.__name__ + "View", (BatchView,), dict(
+                {n: property(lambda v, i=i: v._columns[i][v._index])
+                 for i, n in enumerate(names)}, __slots__=[]))
+            batch = type("Batch", (Batch,), {
+                'record': cls, 'View': view,
+                '_positions': {n: i for i, n in enumerate(names)},
+                '__qualname__': cls.__qualname__ + ".Batch",
+                '__module__': cls.__module__,
+            })
+            view._batch = batch
+            cls._batch_class = batch
+        return batch
+
+
+CaseClass.Batch = BatchProperty()
+
+
 def extract_args(bases):
     args = []
     vararg = None
@@ -125,39 +651,145 @@ def extract_args(bases):
     return args, vararg, kwarg, defaults, all_args
 
 
-def find_members(tree, name):
-    @Scoped
-    @Walker
-    def find_member_assignments(tree, collect, stop, scope, **kw):
-        if name in scope.keys():
-            stop()
-        elif type(tree) is ast.Assign:
-            self_assigns = [
-                t.attr for t in tree.targets
-                if type(t) is ast.Attribute
-                and type(t.value) is ast.Name
-                and t.value.id == name
-            ]
-            for assign in self_assigns:
-                collect(assign)
-    return find_member_assignments.collect(tree)
-
-
-def split_body(tree, gen_sym):
+def target_names(targets):
+    """The names bound by assignment targets, like `analysis.find_names`"""
+    names = []
+    for node in targets:
+        if type(node) is ast.Name:
+            names.append(node.id)
+        elif type(node) in (ast.Tuple, ast.List):
+            names.extend(target_names(node.elts))
+        elif type(node) is ast.Starred:
+            names.extend(target_names([node.value]))
+    return names
+
+
+def find_members(body):
+    """The members of a case class: the `x` of the ``self.x = ...``
+    assignments in the class body, and of the ``arg.x = ...`` in the body
+    of each method where `arg` is its first argument.
+
+    The body is walked once, recording the names each scope binds along
+    with the attribute assignments; an assignment counts if its name is
+    not rebound by an inner scope, as `analysis.Scoped` would see it.
+    Nested classes are skipped, their members are their own."""
+    # a scope is [parent, names bound in it, parameters, method argument]
+    scopes = [[None, set(), set(), None]]
+    assigns = []
+
+    def visit(node, scope, owner):
+        """`owner` is the function or class scope receiving the names
+        bound by plain assignments in `scope`"""
+        t = type(node)
+        if t is ast.Assign:
+            for target in node.targets:
+                if type(target) is ast.Attribute and \
+                   type(target.value) is ast.Name:
+                    assigns.append((scope, target.value.id, target.attr))
+            scopes[owner][1].update(target_names(node.targets))
+        elif t in compat.scope_nodes:
+            scopes[owner][1].add(node.name)
+            if t is ast.ClassDef:
+                if scope == 0:
+                    return
+                visit_all(node.bases, scope, owner)
+                new_scope(node.body, scope, set(), None, True)
+                return
+            visit_all(node.decorator_list, scope, owner)
+            visit_all([d for d in node.args.defaults + node.args.kw_defaults
+                       if d is not None], scope, owner)
+            params = {node.name} | set(extract_arg_names(node.args))
+            method_arg = None
+            if scope == 0 and t is ast.FunctionDef and node.args.args:
+                method_arg = node.args.args[0].arg
+            new_scope(node.body, scope, params, method_arg, True)
+            return
+        elif t is ast.Lambda:
+            new_scope([node.body], scope, set(extract_arg_names(node.args)),
+                      None, False, owner)
+            return
+        elif t in (ast.ListComp, ast.SetComp, ast.GeneratorExp,
+                   ast.DictComp):
+            visit(node.generators[0].iter, scope, owner)
+            names = set(target_names([g.target for g in node.generators]))
+            rest = [node.generators[0].ifs] + [
+                [g.iter] + g.ifs for g in node.generators[1:]]
+            elts = [node.key, node.value] if t is ast.DictComp else \
+                [node.elt]
+            new_scope(elts + [x for xs in rest for x in xs], scope, names,
+                      None, False, owner)
+            return
+        elif t is ast.For:
+            visit_all([node.target, node.iter] + node.orelse, scope, owner)
+            new_scope(node.body, scope, set(target_names([node.target])),
+                      None, False, owner)
+            return
+        elif t is ast.With:
+            visit_all(node.items, scope, owner)
+            names = target_names([i.optional_vars for i in node.items])
+            new_scope(node.body, scope, set(names), None, False, owner)
+            return
+        elif t is ast.ExceptHandler:
+            visit_all([node.type] if node.type else [], scope, owner)
+            new_scope(node.body, scope, {node.name} if node.name else set(),
+                      None, False, owner)
+            return
+        visit_all(ast.iter_child_nodes(node), scope, owner)
+
+    def visit_all(nodes, scope, owner):
+        for node in nodes:
+            visit(node, scope, owner)
+
+    def new_scope(nodes, parent, params, method_arg, owns, owner=None):
+        scopes.append([parent, set(), params, method_arg])
+        scope = len(scopes) - 1
+        visit_all(nodes, scope, scope if owns else owner)
+
+    visit_all(body, 0, 0)
+
+    # the names followed in each scope, parents being created first
+    followed = [{'self'} - scopes[0][1]]
+    for parent, bound, params, method_arg in scopes[1:]:
+        names = followed[parent] - bound - params
+        if method_arg is not None and method_arg not in bound:
+            names.add(method_arg)
+        followed.append(names)
+
+    members = []
+    for scope, name, attr in assigns:
+        if name in followed[scope] and attr not in members:
+            members.append(attr)
+    return members
+
+
+def attach_nested(parent, nested):
+    """``Parent.Nested = Nested``, giving it the qualified name it would
+    have if it had been defined in the body of its parent"""
+    def load(id):
+        return ast.Name(id=id, ctx=ast.Load())
+
+    def store(id, attr):
+        return ast.Attribute(value=load(id), attr=attr, ctx=ast.Store())
+
+    qualname = ast.BinOp(
+        left=ast.Attribute(value=load(parent), attr='__qualname__',
+                           ctx=ast.Load()),
+        op=ast.Add(), right=ast.Str(s="." + nested))
+    return [ast.Assign(targets=[store(parent, nested)], value=load(nested)),
+            ast.Assign(targets=[store(nested, '__qualname__')],
+                       value=qualname)]
+
+
+def split_body(tree, gen_sym, frozen=False):
         new_body = []
         outer = []
         init_body = []
         for statement in tree.body:
             if type(statement) is ast.ClassDef:
                 outer.append(case_transform(statement, gen_sym,
-                                            [ast.Name(id=tree.name)]))
-                with hq as a:
-                    name[tree.name].b = name[statement.name]
-                a_old = a[0]
-                a_old.targets[0].attr = statement.name
-
-                a_new = parse_stmt(unparse(a[0]))[0]
-                outer.append(a_new)
+                                            [ast.Name(id=tree.name)],
+                                            frozen))
+                outer.extend(attach_nested(tree.name, statement.name))
             elif type(statement) is ast.FunctionDef:
                 new_body.append(statement)
             else:
@@ -165,7 +797,8 @@ def split_body(tree, gen_sym):
         return new_body, outer, init_body
 
 
-def prep_initialization(init_fun, args, vararg, kwarg, defaults, all_args):
+def prep_initialization(init_fun, args, vararg, kwarg, defaults, all_args,
+                        frozen=False):
 
     kws = {'vararg': vararg, 'kwarg': kwarg, 'defaults': defaults}
     kws.update({
@@ -179,16 +812,35 @@ def prep_initialization(init_fun, args, vararg, kwarg, defaults, all_args):
 
     init_fun.args = ast.arguments(**kws)
 
+    # the assignments are built directly, as quoting them hygienically
+    # for each field made up much of the expansion of a case class
+    if frozen:
+        setter = hq[set_field]
     for x in all_args:
-        with hq as a:
-            unhygienic[self.x] = name[x]  # noqa: F821
+        if frozen:
+            assignment = ast.Expr(value=ast.Call(
+                func=setter,
+                args=[ast.Name(id='self', ctx=ast.Load()), ast.Str(s=x),
+                      ast.Name(id=x, ctx=ast.Load())],
+                keywords=[]))
+        else:
+            assignment = ast.Assign(
+                targets=[ast.Attribute(value=ast.Name(id='self',
+                                                      ctx=ast.Load()),
+                                       attr=x, ctx=ast.Store())],
+                value=ast.Name(id=x, ctx=ast.Load()))
+        init_fun.body.append(assignment)
 
-        a[0].targets[0].attr = x
 
-        init_fun.body.append(a[0])
+def freeze_statement():
+    """Ends the __init__ of a frozen case class, after which its instances
+    refuse assignments"""
+    with hq as a:
+        set_field(unhygienic[self], '_hash', None)  # noqa: F821
+    return a[0]
 
 
-def shared_transform(tree, gen_sym, additional_args=[]):
+def shared_transform(tree, gen_sym, additional_args=[], frozen=False):
     with hq as methods:
         def __init__(self, *args, **kwargs):
             pass
@@ -210,28 +862,35 @@ def shared_transform(tree, gen_sym, additional_args=[]):
     if kwarg:
         set_kwargs.value = ast.Str(kwarg)
 
-    nested = [
-        n for f in tree.body
-        if type(f) is ast.FunctionDef
-        if len(f.args.args) > 0
-        for n in find_members(f.body, f.args.args[0].arg)
-    ]
+    additional_members = [m for m in find_members(tree.body)
+                          if m not in all_args]
 
-    additional_members = find_members(tree.body, "self") + nested
-
-    prep_initialization(init_fun, args, vararg, kwarg, defaults, all_args)
+    prep_initialization(init_fun, args, vararg, kwarg, defaults, all_args,
+                        frozen)
     set_fields.value.elts = list(map(ast.Str, args))
     set_slots.value.elts = list(map(ast.Str, all_args + additional_members))
-    new_body, outer, init_body = split_body(tree, gen_sym)
+    new_body, outer, init_body = split_body(tree, gen_sym, frozen)
     init_fun.body.extend(init_body)
+    if frozen:
+        init_fun.body.append(freeze_statement())
+        for f in new_body:
+            if type(f) is ast.FunctionDef and f.name == '__init__':
+                f.body.append(freeze_statement())
     tree.body = new_body
     tree.body = methods + tree.body
 
     return outer
 
 
-def case_transform(tree, gen_sym, parents):
-    outer = shared_transform(tree, gen_sym)
+def case_transform(tree, gen_sym, parents, frozen=False):
+    custom_init = any(type(f) is ast.FunctionDef and f.name == '__init__'
+                      for f in tree.body)
+    outer = shared_transform(tree, gen_sym, frozen=frozen)
+    if custom_init:
+        # the arguments of __init__ are no longer the fields
+        tree.body.append(ast.Assign(
+            targets=[ast.Name(id='_custom_init', ctx=ast.Store())],
+            value=ast.NameConstant(value=True)))
     tree.bases = parents
     assign = ast.FunctionDef(
         gen_sym("prepare_"+tree.name),
@@ -251,6 +910,12 @@ def case(tree, gen_sym, **kw):
     return x
 
 
+@macros.decorator
+def frozen(tree, gen_sym, **kw):
+    """A variant of `case` whose instances are immutable and hashed once"""
+    return case_transform(tree, gen_sym, [hq[FrozenCaseClass]], frozen=True)
+
+
 @macros.decorator
 def enum(tree, gen_sym, exact_src, **kw):
 
@@ -301,10 +966,14 @@ def enum(tree, gen_sym, exact_src, **kw):
 
     shared_transform(tree, gen_sym, additional_args=["id", "name"])
 
+    with hq as init:
+        name[tree.name].all = []
+
     with hq as code:
         name[tree.name].__new__ = staticmethod(enum_new)
         name[tree.name].__init__ = noop_init
+        index_enum(name[tree.name])
 
     tree.bases = [hq[Enum]]
 
-    return [tree] + new_assigns + code
+    return [tree] + init + new_assigns + code
@@ -395,16 +395,28 @@ if compat.PY36:
                                             tree.ifs))
     })
 
+def joined_values(tree, i):
+    """The text of the f-string `tree` between its quotes"""
+    return "".join(v.s.replace("{", "{{").replace("}", "}}")
+                   if isinstance(v, ast.Str) else rec(v, i)
+                   for v in tree.values)
+
+
+def formatted_value(tree, i):
+    value = rec(tree.value, i)
+    if value.startswith("{"):
+        value = " " + value
+    return ("{" + value +
+            {-1: "", 115: "!s", 114: "!r", 97: "!a"}[tree.conversion] +
+            ((":" + joined_values(tree.format_spec, i))
+             if tree.format_spec else "") +
+            "}")
+
+
 if compat.HAS_FSTRING:
     trec.update({
-        ast.FormattedValue: lambda tree, i: ("{" +  rec(tree.value, i) +
-                                        {-1: "", 115: "!s", 114: "!r",
-                                         115: "!a"}[tree.conversion] +
-                                        ((":" + tree.format_spec.values[0].s)
-                                         if tree.format_spec else "") +
-                                        "}"),
-        ast.JoinedStr: lambda tree, i: "f" + repr("".join(v.s
-            if isinstance(v, ast.Str) else rec(v, i) for v in tree.values))
+        ast.FormattedValue: formatted_value,
+        ast.JoinedStr: lambda tree, i: "f" + repr(joined_values(tree, i))
     })
 
 
@@ -13,10 +13,10 @@ PYPY = sys.implementation.name == 'pypy'
 
 HAS_FSTRING = CPY and PY36 or PYPY and PY35
 
-if PY34:
-    function_nodes = (ast.FunctionDef,)
-else:
+if PY35:
     function_nodes = (ast.AsyncFunctionDef, ast.FunctionDef)
+else:
+    function_nodes = (ast.FunctionDef,)
 
 scope_nodes = function_nodes + (ast.ClassDef,)
 
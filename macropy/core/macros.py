@@ -160,12 +160,26 @@ class Decorator(MacroType):
           ...
 
     The macros will be expanded with an inside-out order, thus
-    executing ``anothermacro`` first and then ``amacro``.
+    executing ``anothermacro`` first and then ``amacro``. Each of them
+    also receives the whole list of the ``decorators`` of the
+    definition, macros included, and whether it is ``in_class``, that
+    is directly in the body of a class.
     """
 
+    def __init__(self, registry):
+        super().__init__(registry)
+        # the definitions found in the body of a class, which is
+        # expanded before them
+        self.class_members = set()
+
     def detect_macro(self, in_tree):
+        if isinstance(in_tree, ast.ClassDef):
+            self.class_members.update(in_tree.body)
         if (isinstance(in_tree, compat.scope_nodes) and
             len(in_tree.decorator_list)):  # noqa: E129
+            decorators = list(in_tree.decorator_list)
+            kwargs = {'decorators': decorators,
+                      'in_class': in_tree in self.class_members}
             rev_decs = list(reversed(in_tree.decorator_list))
             in_tree.decorator_list = []
             tree = in_tree
@@ -187,7 +201,7 @@ class Decorator(MacroType):
                                            tree.decorator_list)
                     seen_decs = []
                 tree = yield MacroData(self.registry[name], macro_tree, tree,
-                                       call_args, {}, name)
+                                       call_args, kwargs, name)
                 if type(tree) is list:
                     additions = tree[1:]
                     tree = tree[0]
@@ -213,6 +213,9 @@ a: Int
             return
         self.convert_test("""
 f'bar {grande!r:foo}   zoo'
+""")
+        self.convert_test("""
+f'{{a}} { {1:2}[1]!a:>{width}}'
 """)
 
     def test_async(self):
@@ -3,6 +3,11 @@
 std lib.
 """
 
+import os
+import pickle
+import tempfile
+import threading
+
 
 def flatten(xs):
     """Recursively flattens a list of lists of lists (arbitrarily,
@@ -37,15 +42,61 @@ def merge_dicts(*my_dicts):
 
 
 class Lazy(object):
+    """A thunk which returns the value of `thunk()`, evaluated the first
+    time it is called. Threads calling it at the same time wait for a
+    single evaluation, after which the thunk becomes an `EvaluatedLazy`
+    which only returns the value, and drops `thunk` with whatever its
+    closure refers to. If `thunk` raises, the next call tries again."""
+
+    __slots__ = ('thunk', 'value', 'lock', '__weakref__')
 
     def __init__(self, thunk):
         self.thunk = thunk
-        self.val = None
+        self.lock = threading.RLock()
+
+    def __call__(self):
+        lock = self.lock
+        if lock is not None:
+            with lock:
+                if self.thunk is not None:
+                    self.value = self.thunk()
+                    self.__class__ = EvaluatedLazy
+                    self.thunk = self.lock = None
+        return self.value
+
+
+class EvaluatedLazy(Lazy):
+    """A `Lazy` whose value is known."""
+
+    __slots__ = ()
 
     def __call__(self):
-        if self.val is None:
-            self.val = [self.thunk()]
-        return self.val[0]
+        return self.value
+
+
+def load_pickle(path, default=None):
+    """The object pickled in the file `path`, or `default` if there is
+    none, or if it can't be loaded, like the files written by other
+    versions of the code."""
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return default
+
+
+def write_atomic(path, data):
+    """Writes the bytes `data` to the file `path` at once, through a
+    temporary file which replaces it, so that processes reading it at the
+    same time get either the whole file or the previous one."""
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
 
 def distinct(l):
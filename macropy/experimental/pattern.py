@@ -2,8 +2,10 @@
 from abc import ABCMeta, abstractmethod
 import ast
 import inspect
+import itertools
+import weakref
 
-from ..core import util
+from ..core import unparse, util
 from ..core.macros import Macros
 from ..core.walkers import Walker
 
@@ -170,6 +172,47 @@ class WildcardMatcher(Matcher):
         return [('_', 3)]
 
 
+_field_names = weakref.WeakKeyDictionary()
+
+
+def field_names(clazz):
+    """The names of the positional fields of the instances of `clazz`:
+    the ``_fields`` of case classes, namedtuples and AST nodes, or else
+    the arguments of its constructor. They are only looked up once per
+    class."""
+    try:
+        return _field_names[clazz]
+    except KeyError:
+        pass
+    fields = getattr(clazz, '_fields', None)
+    if isinstance(fields, (list, tuple)):
+        names = tuple(fields)
+    else:
+        try:
+            args = inspect.getfullargspec(clazz.__init__).args
+        except TypeError:
+            args = []
+        names = tuple(arg for arg in args if arg != 'self')
+    _field_names[clazz] = names
+    return names
+
+
+def default_unapply(clazz, matchee, kw_keys):
+    """Unapplies `matchee` as an instance of `clazz` whose positional
+    fields are named by `field_names`."""
+    if not isinstance(matchee, clazz):
+        raise PatternMatchException("Matchee should be of type %r" %
+                                    (clazz,))
+    pos_values = (getattr(matchee, arg, None) for arg in field_names(clazz))
+    kw_dict = {}
+    for kw_key in kw_keys:
+        if not hasattr(matchee, kw_key):
+            raise PatternMatchException("Keyword argument match failed: no"
+                                        " attribute %r" % (kw_key,))
+        kw_dict[kw_key] = getattr(matchee, kw_key)
+    return pos_values, kw_dict
+
+
 class ClassMatcher(Matcher):
 
     def __init__(self, clazz, positionalMatchers, **kwMatchers):
@@ -190,27 +233,7 @@ class ClassMatcher(Matcher):
                               for matcher in matchers]))
 
     def default_unapply(self, matchee, kw_keys):
-        if not isinstance(matchee, self.clazz):
-            raise PatternMatchException("Matchee should be of type %r" %
-                                        (self.clazz,))
-        pos_values = []
-        kw_dict = {}
-
-        # We don't get the argspec unless there are actually
-        # positional matchers
-        def genPosValues():
-            arg_spec = inspect.getargspec(self.clazz.__init__)
-            for arg in arg_spec.args:
-                if arg != 'self':
-                    yield(getattr(matchee, arg, None))
-
-        pos_values = genPosValues()
-        for kw_key in kw_keys:
-            if not hasattr(matchee, kw_key):
-                raise PatternMatchException("Keyword argument match failed: no"
-                                            " attribute %r" % (kw_key,))
-            kw_dict[kw_key] = getattr(matchee, kw_key)
-        return pos_values, kw_dict
+        return default_unapply(self.clazz, matchee, kw_keys)
 
     def match(self, matchee):
         updates = []
@@ -261,56 +284,374 @@ class OptionalMatcher(Matcher):
         return self.matchers[0].var_names()
 
 
-def build_matcher(tree, modified):
-    if isinstance(tree, ast.Num):
-        return hq[LiteralMatcher(u[tree.n])]
-    if isinstance(tree, ast.Str):
-        return hq[LiteralMatcher(u[tree.s])]
-    if isinstance(tree, ast.NameConstant):
-        return hq[LiteralMatcher(ast_literal[tree])]
+_unappliers = weakref.WeakKeyDictionary()
+
+
+def class_fields(clazz, matchee, count, kw_keys):
+    """Returns a list of the first `count` positional fields of
+    `matchee` followed by its `kw_keys` fields, as unapplied by `clazz`,
+    or None if `matchee` doesn't match."""
+    try:
+        unapply = _unappliers[clazz]
+    except (KeyError, TypeError):
+        unapply = make_unapply(clazz)
+        try:
+            _unappliers[clazz] = unapply
+        except TypeError:
+            pass
+    return unapply(matchee, count, kw_keys)
+
+
+def make_unapply(clazz):
+    """Builds the function used by `class_fields` to unapply values
+    with `clazz`: it calls the ``__unapply__`` method of `clazz` if it
+    has one, or else reads the fields named by `field_names` from the
+    instances of `clazz`."""
+    if hasattr(clazz, '__unapply__'):
+        custom_unapply = clazz.__unapply__
+
+        def unapply(matchee, count, kw_keys):
+            try:
+                pos_vals, kw_dict = custom_unapply(matchee, kw_keys)
+            except PatternMatchException:
+                return None
+            values = list(itertools.islice(pos_vals, count))
+            if len(values) != count:
+                return None
+            for kw_key in kw_keys:
+                if kw_key not in kw_dict:
+                    return None
+                values.append(kw_dict[kw_key])
+            return values
+        return unapply
+
+    names = field_names(clazz)
+    prefixes = [names[:count] for count in range(len(names) + 1)]
+    missing = object()
+
+    def unapply(matchee, count, kw_keys):
+        if not isinstance(matchee, clazz) or count >= len(prefixes):
+            return None
+        values = [getattr(matchee, arg, None) for arg in prefixes[count]]
+        for kw_key in kw_keys:
+            value = getattr(matchee, kw_key, missing)
+            if value is missing:
+                return None
+            values.append(value)
+        return values
+    return unapply
+
+
+def compile_pattern(tree, subject, gen_sym, steps, bindings, temps):
+    """Compiles the match of the pattern `tree` against the value of the
+    variable named `subject`.
+
+    Appends to `steps` the operations performing the match, which are
+    ``('test', condition, message, key)`` tuples, failing with
+    `message` unless `condition` holds, ``('bind', name, value)``
+    tuples storing intermediate values and ``('either', steps1,
+    steps2)`` tuples trying the steps of the alternatives of a ``|`` in
+    turn. The expression giving the value of each name of the pattern
+    once the steps succeed is recorded in `bindings`.
+
+    The intermediate values are stored in variables named through
+    `temps`, a dict shared by the arms of a ``switch``, so that two
+    arms extracting the same field of the same value use the same
+    variable, and their steps compare equal. Tests compare equal when
+    their keys do."""
+    if isinstance(tree, (ast.Name, ast.Num, ast.Str, ast.NameConstant)):
+        compile_subpattern(tree, ast.Name(subject, ast.Load()), subject,
+                           gen_sym, steps, bindings, temps)
+    elif isinstance(tree, (ast.Tuple, ast.List)):
+        if isinstance(tree, ast.Tuple):
+            test = hq[isinstance(name[subject], tuple)]
+            message = "Expected tuple of %d elements"
+        else:
+            test = hq[isinstance(name[subject], list)]
+            message = "Expected list of length %d"
+        count = len(tree.elts)
+        steps.append(('test', hq[ast_literal[test] and
+                                 len(name[subject]) == u[count]],
+                      message % (count,),
+                      (type(tree).__name__, subject, count)))
+        for i, child in enumerate(tree.elts):
+            compile_subpattern(child, hq[name[subject][u[i]]],
+                               (subject, i), gen_sym, steps, bindings,
+                               temps)
+    elif isinstance(tree, ast.Call):
+        kw_keys = tuple(kw.arg for kw in tree.keywords)
+        fields = temp_name(('fields', subject, ast.dump(tree.func),
+                            len(tree.args), kw_keys), gen_sym, temps)
+        steps.append(('bind', fields, hq[class_fields(
+            ast_literal[tree.func], name[subject], u[len(tree.args)],
+            ast_literal[ast.Tuple(list(map(ast.Str, kw_keys)),
+                                  ast.Load())])]))
+        steps.append(('test', hq[name[fields] is not None],
+                      "Matchee should match %s" % unparse(tree).strip(),
+                      ('class', fields)))
+        children = tree.args + [kw.value for kw in tree.keywords]
+        for i, child in enumerate(children):
+            compile_subpattern(child, hq[name[fields][u[i]]],
+                               (fields, i), gen_sym, steps, bindings,
+                               temps)
+    elif (isinstance(tree, ast.BinOp) and
+          isinstance(tree.op, ast.BitAnd)):
+        compile_pattern(tree.left, subject, gen_sym, steps, bindings, temps)
+        compile_pattern(tree.right, subject, gen_sym, steps, bindings,
+                        temps)
+    elif (isinstance(tree, ast.BinOp) and
+          isinstance(tree.op, ast.BitOr)):
+        alternatives = []
+        for side in [tree.left, tree.right]:
+            side_steps, side_bindings = [], {}
+            compile_pattern(side, subject, gen_sym, side_steps,
+                            side_bindings, temps)
+            alternatives.append((side_steps, side_bindings))
+        (left, left_bindings), (right, right_bindings) = alternatives
+        if set(left_bindings) != set(right_bindings):
+            raise PatternVarMismatch("Alternatives bind %s and %s" % (
+                sorted(left_bindings), sorted(right_bindings)))
+        for var_name in sorted(left_bindings):
+            temp = gen_sym()
+            left.append(('bind', temp, left_bindings[var_name]))
+            right.append(('bind', temp, right_bindings[var_name]))
+            bind_name(var_name, ast.Name(temp, ast.Load()), bindings)
+        steps.append(('either', left, right))
+    else:
+        raise Exception("Unrecognized tree " + repr(tree))
+
+
+def compile_subpattern(tree, value, key, gen_sym, steps, bindings, temps):
+    """Compiles the match of the pattern `tree` against the expression
+    `value`, which is only evaluated once. `key` identifies `value`
+    in `temps`."""
     if isinstance(tree, ast.Name):
-        if tree.id in ['_']:
-            return hq[WildcardMatcher()]
-        modified.add(tree.id)
-        return hq[NameMatcher(u[tree.id])]
-    if isinstance(tree, ast.List):
-        sub_matchers = []
-        for child in tree.elts:
-            sub_matchers.append(build_matcher(child, modified))
-        res = hq[ListMatcher()]
-        res.args = sub_matchers
-        return res
-    if isinstance(tree, ast.Tuple):
-        sub_matchers = []
-        for child in tree.elts:
-            sub_matchers.append(build_matcher(child, modified))
-        res = hq[TupleMatcher()]
-        res.args = sub_matchers
-        return res
-    if isinstance(tree, ast.Call):
-        sub_matchers = []
-        for child in tree.args:
-            sub_matchers.append(build_matcher(child, modified))
-        positional_matchers = ast.List(sub_matchers, ast.Load())
-        kw_matchers = []
-        for kw in tree.keywords:
-            kw_matchers.append(
-                    ast.keyword(kw.arg, build_matcher(kw.value, modified)))
-        res = hq[ClassMatcher()]
-        res.args, res.keywords = [tree.func, positional_matchers], kw_matchers
-        return res
-    if (isinstance(tree, ast.BinOp) and
-        isinstance(tree.op, (ast.BitAnd, ast.BitOr))):  # noqa: E129
-
-        sub1 = build_matcher(tree.left, modified)
-        sub2 = build_matcher(tree.right, modified)
-        if isinstance(tree.op, ast.BitAnd):
-            res = hq[ParallelMatcher()]
+        if tree.id != '_':
+            bind_name(tree.id, value, bindings)
+    elif isinstance(tree, (ast.Num, ast.Str, ast.NameConstant)):
+        steps.append(('test', hq[ast_literal[tree] == ast_literal[value]],
+                      "Literal match failed",
+                      ('literal', key, ast.dump(tree))))
+    else:
+        subject = temp_name(key, gen_sym, temps)
+        steps.append(('bind', subject, value))
+        compile_pattern(tree, subject, gen_sym, steps, bindings, temps)
+
+
+def temp_name(key, gen_sym, temps):
+    if key not in temps:
+        temps[key] = gen_sym()
+    return temps[key]
+
+
+def bind_name(var_name, value, bindings):
+    if var_name in bindings:
+        raise PatternVarConflict("%r is matched more than once" %
+                                 (var_name,))
+    bindings[var_name] = value
+
+
+def assign(var_name, value):
+    return ast.Assign([ast.Name(var_name, ast.Store())], value)
+
+
+def step_key(step):
+    if step[0] == 'test':
+        return ('test', step[3])
+    if step[0] == 'bind':
+        return ('bind', step[1])
+    return ('either', id(step))
+
+
+def skip_bound(steps, bound):
+    """Drops the leading steps of `steps` binding a variable in
+    `bound`, which already holds the same value."""
+    count = 0
+    while (count < len(steps) and steps[count][0] == 'bind' and
+           steps[count][1] in bound):
+        count += 1
+    return steps[count:]
+
+
+def matching_statements(steps, success, gen_sym, bound=frozenset()):
+    """The statements performing `steps` as nested ifs, which run the
+    statements `success` if all the tests pass and fall through
+    otherwise. The variables named in `bound` are already set."""
+    steps = skip_bound(steps, bound)
+    if not steps:
+        return success
+    if steps[0][0] == 'test':
+        count = 1
+        while count < len(steps) and steps[count][0] == 'test':
+            count += 1
+        tests = [step[1] for step in steps[:count]]
+        test = tests[0] if count == 1 else ast.BoolOp(ast.And(), tests)
+        return [ast.If(test, matching_statements(steps[count:], success,
+                                                 gen_sym, bound), [])]
+    if steps[0][0] == 'bind':
+        return [assign(steps[0][1], steps[0][2])] + matching_statements(
+            steps[1:], success, gen_sym, bound | {steps[0][1]})
+    matched, statements = either_statements(steps[0], gen_sym, bound)
+    statements.append(ast.If(ast.Name(matched, ast.Load()),
+                             matching_statements(steps[1:], success,
+                                                 gen_sym, bound), []))
+    return statements
+
+
+def either_statements(step, gen_sym, bound=frozenset()):
+    """The statements trying each alternative of an ``'either'`` step in
+    turn, and the name of the variable set to True once one matches."""
+    matched = gen_sym()
+    statements = [assign(matched, ast.NameConstant(False))]
+    for alternative in step[1:]:
+        body = matching_statements(
+            alternative, [assign(matched, ast.NameConstant(True))], gen_sym,
+            bound)
+        if len(statements) > 1:
+            body = [ast.If(hq[not name[matched]], body, [])]
+        statements.extend(body)
+    return matched, statements
+
+
+def decision_tree(arms, done, gen_sym, bound=frozenset()):
+    """The statements trying `arms`, ``(steps, success)`` pairs, in
+    order until one of them sets the variable named `done`.
+
+    Consecutive arms starting with the same step share it: the arms of
+    a ``switch`` testing the same class with the same number of fields
+    extract the fields of the value once, and test the result once,
+    before trying the rest of each arm in turn. The variables named in
+    `bound` are already set, by the steps of an outer node or by the
+    first step of a previous arm, which ran before this one was
+    tried."""
+    statements = []
+    start = 0
+    while start < len(arms):
+        steps = skip_bound(arms[start][0], bound)
+        end = start + 1
+        if steps:
+            key = step_key(steps[0])
+            while end < len(arms):
+                other = skip_bound(arms[end][0], bound)
+                if not other or step_key(other[0]) != key:
+                    break
+                end += 1
+        if end == start + 1:
+            node = matching_statements(steps, arms[start][1], gen_sym,
+                                       bound)
+        else:
+            rest = [(skip_bound(arm_steps, bound)[1:], success)
+                    for arm_steps, success in arms[start:end]]
+            if steps[0][0] == 'bind':
+                node = [assign(steps[0][1], steps[0][2])] + decision_tree(
+                    rest, done, gen_sym, bound | {steps[0][1]})
+            else:
+                node = [ast.If(steps[0][1],
+                               decision_tree(rest, done, gen_sym, bound),
+                               [])]
+        if start:
+            node = [ast.If(hq[not name[done]], node, [])]
+        statements.extend(node)
+        if steps and steps[0][0] == 'bind':
+            bound = bound | {steps[0][1]}
+        start = end
+    return statements
+
+
+def raising_statements(steps, gen_sym):
+    """The statements performing `steps`, raising PatternMatchException
+    when a test fails."""
+    statements = []
+    bound = frozenset()
+    for step in steps:
+        if step[0] == 'test':
+            with hq as stmts:
+                if not ast_literal[step[1]]:
+                    raise PatternMatchException(u[step[2]])
+            statements.extend(stmts)
+        elif step[0] == 'bind':
+            if step[1] not in bound:
+                statements.append(assign(step[1], step[2]))
+                bound = bound | {step[1]}
         else:
-            res = hq[OptionalMatcher()]
-        res.args = [sub1, sub2]
-        return res
-    raise Exception("Unrecognized tree " + repr(tree))
+            matched, stmts = either_statements(step, gen_sym, bound)
+            statements.extend(stmts)
+            with hq as stmts:
+                if not name[matched]:
+                    raise PatternMatchException("No alternative matched")
+            statements.extend(stmts)
+    return statements
+
+
+def compile_arm(pattern, value, gen_sym, temps):
+    """Compiles the match of `pattern` against `value`, returning its
+    steps, starting with the evaluation of `value`, and its bindings.
+    `value` is either an expression or the name of a variable which the
+    match can't modify, like the value of a ``switch``."""
+    steps, bindings = [], {}
+    if isinstance(value, str):
+        subject = value
+    else:
+        subject = gen_sym()
+        steps.append(('bind', subject, value))
+    compile_pattern(pattern, subject, gen_sym, steps, bindings, temps)
+    return steps, bindings
+
+
+def conflict_statements(e):
+    """The statements raising the error `e` found while compiling a
+    pattern, when the pattern is reached."""
+    if isinstance(e, PatternVarMismatch):
+        return [ast.Raise(hq[PatternVarMismatch(u[str(e)])], None)]
+    return [ast.Raise(hq[PatternVarConflict(u[str(e)])], None)]
+
+
+def binding_statements(bindings):
+    return [assign(var_name, bindings[var_name])
+            for var_name in sorted(bindings)]
+
+
+def compile_match(pattern, value, gen_sym):
+    """The statements matching `pattern` against `value`, assigning the
+    names of the pattern only if the whole match succeeds."""
+    try:
+        steps, bindings = compile_arm(pattern, value, gen_sym, {})
+    except (PatternVarConflict, PatternVarMismatch) as e:
+        return conflict_statements(e)
+    return raising_statements(steps, gen_sym) + binding_statements(bindings)
+
+
+def compile_arms(arms, orelse, gen_sym):
+    """Compiles an if/elif chain whose arms are ``(pattern, value,
+    body)`` tuples, or ``(None, test, body)`` for the arms testing a
+    plain condition, into a `decision_tree` so that a failed match
+    falls through to the next arm without raising."""
+    if len(arms) == 1 and not orelse:
+        done = None
+        set_done = []
+    else:
+        done = gen_sym()
+        set_done = [assign(done, ast.NameConstant(True))]
+    temps = {}
+    compiled = []
+    for pattern, value, body in arms:
+        if pattern is None:
+            steps = [('test', value, None, ('condition', len(compiled)))]
+            compiled.append((steps, set_done + body))
+            continue
+        try:
+            steps, bindings = compile_arm(pattern, value, gen_sym, temps)
+        except (PatternVarConflict, PatternVarMismatch) as e:
+            compiled.append(([], conflict_statements(e)))
+            continue
+        compiled.append((steps, set_done + binding_statements(bindings) +
+                         body))
+    statements = decision_tree(compiled, done, gen_sym)
+    if done:
+        statements.insert(0, assign(done, ast.NameConstant(False)))
+    if orelse:
+        statements.append(ast.If(hq[not name[done]], orelse, []))
+    return statements
 
 
 def _is_pattern_match_stmt(tree):
@@ -326,22 +667,7 @@ def _is_pattern_match_expr(tree):
 @Walker
 def _matching_walker(tree, gen_sym, **kw):
     if _is_pattern_match_stmt(tree):
-        modified = set()
-        matcher = build_matcher(tree.value.left, modified)
-        temp = gen_sym()
-        # lol random names for hax
-        with hq as assignment:
-            name[temp] = ast_literal[matcher]
-
-        statements = [assignment, ast.Expr(hq[name[temp]._match_value(
-            ast_literal[tree.value.right])])]
-
-        for var_name in modified:
-            statements.append(ast.Assign(
-                [ast.Name(var_name, ast.Store())],
-                hq[name[temp].get_var(u[var_name])]))
-
-        return statements
+        return compile_match(tree.value.left, tree.value.right, gen_sym)
     else:
         return tree
 
@@ -357,15 +683,13 @@ def _matching(tree, gen_sym, **kw):
 
 
 def _rewrite_if(tree, var_name=None, gen_sym=None, **kw_args):
-    # TODO refactor into a _rewrite_switch and a _rewrite_if
     """
     Rewrite if statements to treat pattern matches as boolean
     expressions.
 
-    Recall that normally a pattern match is a statement which will
-    throw a PatternMatchException if the match fails.  We can
-    therefore use try-blocks to produce the desired branching
-    behavior.
+    The arms of an if/elif chain whose tests are pattern matches are
+    compiled by `compile_arms`, so that a failed match moves on to the
+    next arm without raising an exception.
 
     var_name is an optional parameter used for rewriting switch
     statements.
@@ -373,40 +697,26 @@ def _rewrite_if(tree, var_name=None, gen_sym=None, **kw_args):
     If present, it will transform predicates which are expressions
     into pattern matches.
     """
-
-    # with q as rewritten:
-    #     try:
-    #         with matching:
-    #             u%(matchPattern)
-    #         u%(successBody)
-    #     except PatternMatchException:
-    #         u%(_maybe_rewrite_if(failBody))
-    # return rewritten
     if not isinstance(tree, ast.If):
         return tree
 
-    if var_name:
-        tree.test = ast.BinOp(tree.test, ast.LShift(),
-                              ast.Name(var_name, ast.Load()))
-    elif not (isinstance(tree.test, ast.BinOp) and
-              isinstance(tree.test.op, ast.LShift)):
-        return tree
-
-    handler = ast.ExceptHandler(hq[PatternMatchException], None, tree.orelse)
-    try_stmt = ast.Try(tree.body, [handler], [], [])
-
-    match = [ast.Expr(tree.test)]
-
-    _matching_walker.recurse(match, gen_sym=gen_sym)
-    try_stmt.body = match + try_stmt.body
-
-    if len(handler.body) == 1:  # (== tree.orelse)
-        # Might be an elif
-        handler.body = [_rewrite_if(handler.body[0], var_name, gen_sym)]
-    elif not handler.body:
-        handler.body = [ast.Pass()]
+    arms = []
+    node = tree
+    while True:
+        if var_name:
+            arms.append((node.test, var_name, node.body))
+        elif _is_pattern_match_expr(node.test):
+            arms.append((node.test.left, node.test.right, node.body))
+        elif arms:
+            arms.append((None, node.test, node.body))
+        else:
+            return tree
+        if len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If):
+            node = node.orelse[0]
+        else:
+            break
 
-    return try_stmt
+    return compile_arms(arms, node.orelse, gen_sym)
 
 
 @macros.block
@@ -1,38 +1,302 @@
 # -*- coding: utf-8 -*-
 import ast
+import asyncio
+import datetime
+import decimal
+import hashlib
+import itertools
+import os
+import pickle
 
 import sqlalchemy
 
 from ..core.macros import Macros
+from ..core.util import load_pickle, write_atomic
 from ..core.walkers import Walker
 
 from ..core import Captured  # noqa: F401
 from ..core.quotes import ast_literal, name
-from ..core.hquotes import macros, hq, ast_list
+from ..core.hquotes import macros, hq, ast_list, u
 from ..quick_lambda import macros, f, _  # noqa: F401,F811
+from ..quick_lambda import get_interned
 
 
 macros = Macros()  # noqa: F811
 
+# The number of statements kept for each call site, one for each kind
+# of values embedded into them
+STATEMENTS_PER_SITE = 100
+
+# The SQL compiled for the statements of all the call sites, which the
+# connections look up by statement, dialect and parameter names
+compiled_cache = sqlalchemy.util.LRUCache(1000)
+
+# The values which become bind parameters when they are compared to or
+# combined with a column
+PARAM_TYPES = frozenset([int, float, str, bytes, bool, decimal.Decimal,
+                         datetime.date, datetime.datetime, datetime.time,
+                         datetime.timedelta])
+
+# The number of rows fetched at a time by `stream`, `batches` and
+# `columns`
+BATCH_SIZE = 1000
+
+_param_keys = itertools.count()
+
 
 @macros.expr
-def sql(tree, **kw):
-    x = process(tree)
-    x = expand_let_bindings.recurse(x)
-    return x
+def sql(tree, gen_sym, interned_name, interned_count, **kw):
+    return run_query('select', tree, (), gen_sym, interned_name,
+                     interned_count)
+
+
+@macros.expr
+def query(tree, gen_sym, interned_name, interned_count, **kw):
+    return run_query('fetchall', tree, (), gen_sym, interned_name,
+                     interned_count)
+
+
+@macros.expr
+def stream(tree, args, gen_sym, interned_name, interned_count, **kw):
+    """Like `query`, but yields the rows as they are fetched, in batches
+    of `BATCH_SIZE` rows or of the size given as in ``stream(100)[...]``.
+    """
+    return run_query('stream', tree, args, gen_sym, interned_name,
+                     interned_count)
 
 
 @macros.expr
-def query(tree, gen_sym, **kw):
+def batches(tree, args, gen_sym, interned_name, interned_count, **kw):
+    """Like `stream`, but yields lists of rows."""
+    return run_query('batches', tree, args, gen_sym, interned_name,
+                     interned_count)
+
+
+@macros.expr
+def columns(tree, args, gen_sym, interned_name, interned_count, **kw):
+    """Like `query`, but returns a list of the values of each column,
+    fetching the rows in batches like `stream`."""
+    return run_query('columns', tree, args, gen_sym, interned_name,
+                     interned_count)
+
+
+@macros.expr
+def async_query(tree, args, gen_sym, interned_name, interned_count, **kw):
+    """Like `query`, but returns an awaitable of the rows, fetched in
+    the executor given as in ``async_query(executor)[...]``, or in the
+    default executor of the event loop."""
+    return run_query('fetchall_async', tree, args, gen_sym, interned_name,
+                     interned_count)
+
+
+def run_query(method, tree, args, gen_sym, interned_name, interned_count):
+    """The call of the `method` of the `CompiledQuery` of `tree`, with
+    the `args` of the macro."""
+    site, values = compile_query(tree, gen_sym, interned_name,
+                                 interned_count)
+    call = hq[ast_literal[site].select(ast_literal[values])]
+    call.func.attr = method
+    call.args.extend(args)
+    return call
+
+
+def compile_query(tree, gen_sym, interned_name, interned_count):
+    """The expression of the `CompiledQuery` of the call site `tree`,
+    created the first time it runs and then kept in the store of the
+    ``interned`` macro, and the tuple of the values to run it with.
+    These are the subexpressions of `tree` computing a value for the
+    whole query, which become the parameters of the function building
+    the statement."""
+    hoisted = []
+    tree = hoist_values.recurse(tree, gen_sym=gen_sym,
+                                targets=target_names(tree), values=hoisted)
     x = process(tree)
     x = expand_let_bindings.recurse(x)
-    sym = gen_sym()
-    # return q[(lambda query: query.bind.execute(query).fetchall())(ast[x])]
-    new_tree = hq[(lambda query: name[sym].bind.execute(
-        name[sym]).fetchall())(ast_literal[x])]
-    new_tree.func.args = ast.arguments([ast.arg(sym, None)], None, [], [],
-                                       None, [])
-    return new_tree
+    build = hq[lambda: ast_literal[x]]
+    build.args.args = [ast.arg(arg=sym) for sym, _, _ in hoisted]
+    operands = ast.Tuple([ast.Num(i) for i, (_, _, operand)
+                          in enumerate(hoisted) if operand], ast.Load())
+    interned_count[0] += 1
+    site = hq[get_interned(name[interned_name], u[interned_count[0] - 1],
+                           lambda: CompiledQuery(ast_literal[build],
+                                                 ast_literal[operands]))]
+    values = ast.Tuple([value for _, value, _ in hoisted], ast.Load())
+    return site, values
+
+
+def target_names(tree):
+    """The names bound by the generator expressions of `tree`."""
+    return {node.id
+            for genexp in ast.walk(tree) if type(genexp) is ast.GeneratorExp
+            for gen in genexp.generators
+            for node in ast.walk(gen.target) if type(node) is ast.Name}
+
+
+@Walker
+def hoist_values(tree, set_ctx, set_ctx_for, stop, gen_sym, targets, values,
+                 operand=False, callee=False, **kw):
+    """Replaces the subexpressions which use names but none of `targets`
+    with new names, appending ``(name, subexpression, operand)`` to
+    `values`, where `operand` tells if it is compared to or combined
+    with something else. The functions called on columns, like
+    ``func.sum``, are left in place."""
+    if isinstance(tree, ast.expr) and not isinstance(tree, ast.Starred):
+        names = [node.id for node in ast.walk(tree)
+                 if type(node) is ast.Name]
+        if names and targets.isdisjoint(names):
+            stop()
+            if callee:
+                return tree
+            sym = gen_sym("value")
+            values.append((sym, tree, operand))
+            return ast.Name(sym, ast.Load())
+    set_ctx(operand=False, callee=False)
+    if type(tree) is ast.Compare:
+        set_ctx_for(tree.left, operand=True)
+        set_ctx_for(tree.comparators, operand=True)
+    elif type(tree) is ast.BinOp:
+        set_ctx_for(tree.left, operand=True)
+        set_ctx_for(tree.right, operand=True)
+    elif type(tree) is ast.Call:
+        set_ctx_for(tree.func, callee=True)
+
+
+class CompiledQuery(object):
+    """The statements of a ``sql`` or ``query`` call site, built by
+    `build` from the values hoisted out of the query.
+
+    The values at the `operands` indexes whose type is in `PARAM_TYPES`
+    are passed to `build` as bind parameters, so that the statement is
+    built once and runs with whatever values they have. The others are
+    embedded into the statement, which is built again for each new
+    kind of them, like other tables or lists, and on each call if some
+    of them could change in place.
+    """
+
+    def __init__(self, build, operands):
+        self.build = build
+        self.params = {i: "pinq_%d" % next(_param_keys) for i in operands}
+        self.statements = sqlalchemy.util.LRUCache(STATEMENTS_PER_SITE)
+
+    def statement(self, values):
+        """The statement for `values`, and the values of its bind
+        parameters."""
+        key = []
+        params = {}
+        for i, value in enumerate(values):
+            param = self.params.get(i)
+            if param is not None and type(value) in PARAM_TYPES:
+                params[param] = value
+                key.append(param)
+            else:
+                key.append(value_key(value))
+        if None in key:
+            return self.build(*values), {}
+        key = tuple(key)
+        entry = self.statements.get(key)
+        if entry is None:
+            args = [sqlalchemy.bindparam(key[i], value,
+                                         type_=sqlalchemy.types.NULLTYPE)
+                    if key[i] in params else value
+                    for i, value in enumerate(values)]
+            # the values keep the objects identified by id in the key
+            entry = (self.build(*args), values)
+            self.statements[key] = entry
+        return entry[0], params
+
+    def select(self, values):
+        """The statement of the ``sql`` macro, with its parameters
+        bound."""
+        statement, params = self.statement(values)
+        if params:
+            statement = statement.params(params)
+        return statement
+
+    def execute(self, values, **options):
+        """Runs the statement on the engine or connection of its tables
+        with the execution `options`, keeping the compiled SQL in the
+        `compiled_cache`."""
+        statement, params = self.statement(values)
+        bind = statement.bind
+        if isinstance(bind, sqlalchemy.engine.Engine):
+            bind = bind.connect(close_with_result=True)
+        connection = bind.execution_options(compiled_cache=compiled_cache,
+                                            **options)
+        if params:
+            return connection.execute(statement, params)
+        return connection.execute(statement)
+
+    def fetchall(self, values):
+        """The rows of the ``query`` macro."""
+        return self.execute(values).fetchall()
+
+    def fetchall_async(self, values, executor=None):
+        """The future of the rows of the ``async_query`` macro, which runs
+        `fetchall` in a thread of `executor`. The connections come from
+        the pool of the engine as usual."""
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(executor, self.fetchall, values)
+
+    def batches(self, values, size=BATCH_SIZE):
+        """Yields the rows of the statement in lists of `size` rows,
+        using a server-side cursor on the databases which support them.
+        The statement runs when the iteration starts, and its result is
+        closed when the iteration ends or is abandoned."""
+        result = self.execute(values, stream_results=True)
+        try:
+            while True:
+                rows = result.fetchmany(size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            result.close()
+
+    def stream(self, values, size=BATCH_SIZE):
+        """Yields the rows of the statement, fetched `size` at a time."""
+        for rows in self.batches(values, size):
+            yield from rows
+
+    def columns(self, values, size=BATCH_SIZE):
+        """The list of the values of each column of the statement, which
+        keeps only `size` rows at a time."""
+        result = self.execute(values, stream_results=True)
+        try:
+            columns = [[] for key in result.keys()]
+            while True:
+                rows = result.fetchmany(size)
+                if not rows:
+                    break
+                for column, items in zip(columns, zip(*rows)):
+                    column.extend(items)
+        finally:
+            result.close()
+        return columns
+
+
+def value_key(value):
+    """The key of a `value` embedded into a statement, equal for values
+    giving the same statement, or None if the statement can't be kept
+    for it: scalars and containers of them compare by value, tables by
+    identity and named aliases by table and name. Other objects, like
+    dicts, could change in place after the statement is built."""
+    kind = type(value)
+    if kind in PARAM_TYPES or value is None:
+        return kind, value
+    elif kind in (tuple, list, set, frozenset):
+        keys = [value_key(item) for item in value]
+        if None in keys:
+            return None
+        if kind in (set, frozenset):
+            return kind, frozenset(keys)
+        return kind, tuple(keys)
+    elif isinstance(value, sqlalchemy.Table):
+        return kind, id(value)
+    elif (isinstance(value, sqlalchemy.sql.Alias) and
+          type(value.name) is str and
+          isinstance(value.element, sqlalchemy.Table)):
+        return kind, id(value.element), value.name
+    return None
 
 
 def process(tree):
@@ -101,16 +365,77 @@ def process(tree):
     return recurse.recurse(tree)
 
 
-def generate_schema(engine):
-    metadata = sqlalchemy.MetaData(engine)
-    metadata.reflect()
+def generate_schema(engine, cache_dir=None, version=None, lazy=False):
+    """An object with the tables of the database of `engine` as
+    attributes.
+
+    If `cache_dir` is given, the reflected schema is saved in a file of
+    it named after the URL of `engine` and `version`, and loaded from it
+    instead of querying the database the next times. The `version`,
+    like a migration number or hash, should change with the schema. If
+    `lazy` is true, each table is reflected the first time it is
+    accessed rather than all at once."""
+    path = None
+    complete, metadata = False, None
+    if cache_dir is not None:
+        key = "%s\n%s" % (engine.url, version)
+        path = os.path.join(cache_dir, "pinq-%s.pickle" % hashlib.sha1(
+            key.encode('utf-8')).hexdigest())
+        complete, metadata = load_schema(path)
+    if metadata is None:
+        metadata = sqlalchemy.MetaData()
+    metadata.bind = engine
+    if not (lazy or complete):
+        # keeps the tables loaded from a lazy schema
+        metadata.reflect()
+        complete = True
+        if path is not None:
+            save_schema(path, complete, metadata)
+    return Db(metadata, complete, path)
+
+
+def load_schema(path):
+    """Whether the schema saved in the file `path` has all the tables,
+    and its metadata, or False and None if there is none."""
+    return load_pickle(path, (False, None))
+
+
+def save_schema(path, complete, metadata):
+    """Writes the schema to the file `path` at once, so that processes
+    starting at the same time read either the whole file or none."""
+    write_atomic(path, pickle.dumps((complete, metadata),
+                                    pickle.HIGHEST_PROTOCOL))
+
+
+class Db(object):
+    """The tables of `metadata` as attributes. Those which are not in it
+    yet are reflected when they are accessed, and the schema saved again
+    in the file `path` if it is not None."""
+
+    def __init__(self, metadata, complete=True, path=None):
+        self._metadata = metadata
+        self._complete = complete
+        self._path = path
+        for table in metadata.sorted_tables:
+            setattr(self, table.name, table)
 
-    class Db:
-        pass
-    db = Db()
-    for table in metadata.sorted_tables:
-        setattr(db, table.name, table)
-    return db
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._complete:
+            # all the tables were reflected, and are attributes
+            raise AttributeError("No table named %r" % name)
+        try:
+            table = sqlalchemy.Table(name, self._metadata, autoload=True)
+        except sqlalchemy.exc.NoSuchTableError:
+            raise AttributeError("No table named %r" % name)
+        # with the tables its foreign keys refer to
+        for other in self._metadata.sorted_tables:
+            setattr(self, other.name, other)
+        setattr(self, name, table)
+        if self._path is not None:
+            save_schema(self._path, self._complete, self._metadata)
+        return table
 
 
 @Walker
@@ -1,11 +1,14 @@
 import ast
 import enum
 import functools
+from types import MethodType
 
 from ..core import Captured  # noqa: F401
 from ..core.hquotes import macros, hq  # noqa: F811
+from ..core.quotes import macros, ast_literal  # noqa: F811
 from ..core.macros import Macros
 from ..core.walkers import Walker
+from ..core import compat
 from ..core.compat import PY35
 
 if not PY35:
@@ -17,8 +20,6 @@ from .pattern import (  # noqa: F401,F811
 
 macros = Macros()  # noqa: F811
 
-in_tc_stack = [False]
-
 TCOType = enum.Enum('TCOType', ('IGNORE', 'CALL'))
 
 
@@ -26,28 +27,42 @@ def trampoline(func, args, kwargs):
     """
     Repeatedly apply a function until it returns a value.
 
-    The function may return (tco.CALL, func, args, kwargs) or (tco.IGNORE,
-    func, args, kwargs) or just a value.
+    The function may return (TCOType.CALL, func, args, kwargs) or
+    (TCOType.IGNORE, func, args, kwargs) or just a value, where args is
+    a tuple and kwargs a dict or None.
+
+    The functions decorated with `trampoline_decorator` are called
+    through the undecorated function stored in their ``tco`` attribute,
+    which returns such tuples to this trampoline instead of starting a
+    new one. The functions wrapping them with `functools.wraps` copy
+    ``tco`` too, but only in the trampolined ones is it also the
+    ``__wrapped__`` function, so the others are called as they are. As this keeps no state outside of the loop, trampolines
+    can run in several threads or tasks at once.
     """
 
+    call, ignore = TCOType.CALL, TCOType.IGNORE
     ignoring = False
     while True:
-        # We can only set this if we know it will be immediately unset by func
-        if hasattr(func, 'tco'):
-            in_tc_stack[0] = True
-        result = func(*args, **kwargs)
+        body = getattr(func, 'tco', None)
+        # other decorators wrapping a @tco function copy its attribute
+        if body is not None and body is getattr(func, '__wrapped__', None):
+            if type(func) is MethodType:
+                func = MethodType(body, func.__self__)
+            else:
+                func = body
+        if kwargs is None:
+            result = func(*args)
+        else:
+            result = func(*args, **kwargs)
         # for performance reasons, do not use pattern matching here
-        if isinstance(result, tuple):
-            if result[0] is TCOType.CALL:
-                func = result[1]
-                args = result[2]
-                kwargs = result[3]
+        if type(result) is tuple and len(result) == 4:
+            kind = result[0]
+            if kind is call:
+                kind, func, args, kwargs = result
                 continue
-            elif result[0] is TCOType.IGNORE:
+            elif kind is ignore:
                 ignoring = True
-                func = result[1]
-                args = result[2]
-                kwargs = result[3]
+                kind, func, args, kwargs = result
                 continue
         if ignoring:
             return None
@@ -59,93 +74,248 @@ def trampoline_decorator(func):
 
     @functools.wraps(func)
     def trampolined(*args, **kwargs):
-        if in_tc_stack[0]:
-            in_tc_stack[0] = False
-            return func(*args, **kwargs)
-        in_tc_stack.append(False)
-        return trampoline(func, args, kwargs)
+        return trampoline(func, args, kwargs or None)
+
+    trampolined.tco = func
+    return trampolined
+
+
+async def async_trampoline(func, args, kwargs):
+    """
+    The `trampoline` of ``@tco async def`` functions, which awaits the
+    result of each call.
+
+    The tail calls are awaited within the coroutine of the trampoline,
+    so they don't create tasks, and the functions decorated with
+    `async_trampoline_decorator` are called through the undecorated
+    function stored in their ``async_tco`` attribute.
+    """
+
+    call, ignore = TCOType.CALL, TCOType.IGNORE
+    ignoring = False
+    while True:
+        body = getattr(func, 'async_tco', None)
+        # other decorators wrapping a @tco function copy its attribute
+        if body is not None and body is getattr(func, '__wrapped__', None):
+            if type(func) is MethodType:
+                func = MethodType(body, func.__self__)
+            else:
+                func = body
+        if kwargs is None:
+            result = await func(*args)
+        else:
+            result = await func(*args, **kwargs)
+        if type(result) is tuple and len(result) == 4:
+            kind = result[0]
+            if kind is call:
+                kind, func, args, kwargs = result
+                continue
+            elif kind is ignore:
+                ignoring = True
+                kind, func, args, kwargs = result
+                continue
+        if ignoring:
+            return None
+        else:
+            return result
 
-    trampolined.tco = True
+
+def async_trampoline_decorator(func):
+
+    @functools.wraps(func)
+    async def trampolined(*args, **kwargs):
+        return await async_trampoline(func, args, kwargs or None)
+
+    trampolined.async_tco = func
     return trampolined
 
 
+def bounce(kind, call):
+    """The statement returning the tail `call` to the trampoline as a
+    `kind` tuple. Its positional arguments, including the starred ones,
+    become a tuple, and its keyword arguments a dict, or None if there
+    are none so that calls with positional arguments don't allocate
+    one."""
+    args = ast.Tuple(call.args, ast.Load())
+    kwargs = ast.NameConstant(None)
+    if call.keywords:
+        kwargs = ast.Dict([ast.Str(kw.arg) if kw.arg else None
+                           for kw in call.keywords],
+                          [kw.value for kw in call.keywords])
+    with hq as code:
+        return (ast_literal[kind], ast_literal[call.func], ast_literal[args],
+                ast_literal[kwargs])
+    return code
+
+
+def loop_params(tree):
+    """The names of the parameters of the function `tree`, which its
+    tail calls to itself rebind before starting its body again, or None
+    if it can't be turned into a loop: because it takes ``*args`` or
+    ``**kwargs``, looks like a method, where its name doesn't refer to
+    itself, rebinds its own name, is a generator or defines closures,
+    which could capture the parameters."""
+    args = tree.args
+    positional = getattr(args, 'posonlyargs', []) + args.args
+    if args.vararg or args.kwarg:
+        return None
+    if positional and positional[0].arg in ('self', 'cls'):
+        return None
+    for stmt in tree.body:
+        for node in ast.walk(stmt):
+            if isinstance(node, compat.scope_nodes + (
+                    ast.Lambda, ast.GeneratorExp, ast.Yield, ast.YieldFrom,
+                    ast.Global, ast.Nonlocal)):
+                return None
+            if (isinstance(node, ast.Name) and node.id == tree.name and
+                    not isinstance(node.ctx, ast.Load)):
+                return None
+    return [arg.arg for arg in positional + args.kwonlyargs]
+
+
+def rebind_params(tree, call, params):
+    """The statements rebinding `params` to the arguments of `call` and
+    starting the body of the function `tree` again, if `call` is a call
+    to `tree` passing each parameter exactly once, else None."""
+    if not (isinstance(call.func, ast.Name) and call.func.id == tree.name):
+        return None
+    args = tree.args
+    positional = getattr(args, 'posonlyargs', []) + args.args
+    if (len(call.args) > len(positional) or
+            any(isinstance(arg, ast.Starred) for arg in call.args)):
+        return None
+    names = [arg.arg for arg in positional[:len(call.args)]]
+    values = list(call.args)
+    keyword_names = params[len(getattr(args, 'posonlyargs', [])):]
+    for keyword in call.keywords:
+        if keyword.arg not in keyword_names or keyword.arg in names:
+            return None
+        names.append(keyword.arg)
+        values.append(keyword.value)
+    if len(names) != len(params):
+        return None
+    changed = [(name, value) for name, value in zip(names, values)
+               if not (isinstance(value, ast.Name) and value.id == name)]
+    statements = []
+    if len(changed) == 1:
+        statements.append(ast.Assign([ast.Name(changed[0][0], ast.Store())],
+                                     changed[0][1]))
+    elif changed:
+        statements.append(ast.Assign(
+            [ast.Tuple([ast.Name(name, ast.Store()) for name, _ in changed],
+                       ast.Store())],
+            ast.Tuple([value for _, value in changed], ast.Load())))
+    return statements + [ast.Continue()]
+
+
+def returns_none(tree):
+    """Whether all the return statements of the function `tree` return
+    None."""
+    return all(node.value is None for stmt in tree.body
+               for node in ast.walk(stmt) if isinstance(node, ast.Return))
+
+
+def tail_call(node, is_async):
+    """The call returned by the expression `node` when it is in a tail
+    position, or None. In ``async def`` functions only awaited calls are
+    tail calls, the trampoline awaiting them in their place."""
+    if is_async:
+        if not isinstance(node, ast.Await):
+            return None
+        node = node.value
+    return node if isinstance(node, ast.Call) else None
+
+
 @macros.decorator
-def tco(tree, **kw):
+def tco(tree, decorators=(), in_class=False, **kw):
+
+    is_async = isinstance(tree, ast.AsyncFunctionDef)
+    # The name of a function defined in a class body doesn't refer to
+    # it, and other decorators may replace it with a wrapper which has
+    # to run on each call
+    params = None
+    if len(decorators) <= 1 and not in_class:
+        params = loop_params(tree)
+    # Whether some tail calls were turned into a loop, and whether some
+    # are left to the trampoline
+    looped = [False]
+    bounces = [False]
+
+    def self_call(call, in_loop):
+        if params is None or in_loop:
+            return None
+        code = rebind_params(tree, call, params)
+        if code is not None:
+            looped[0] = True
+        return code
 
     @Walker
     # Replace returns of calls
-    def return_replacer(tree, **kw):
-        with switch(tree):
-            if ast.Return(value=ast.Call(
-                    func=func,
-                    args=args,
-                    keywords=keywords)):
-                starred = [arg for arg in args if isinstance(arg, ast.Starred)]
-                kwargs = [kw for kw in keywords if kw.arg is None]
-
-                if len(kwargs):
-                    kwargs = kwargs[0].value
-                if len(starred):
-                    starred = starred[0].value
-                    with hq as code:
-                    # get rid of starargs
-                        return (TCOType.CALL,
-                                ast_literal[func],
-                                (ast_literal[ast.List(args, ast.Load())] +
-                                 list(ast_literal[starred])),
-                                ast_literal[kwargs or ast.Dict([],[])])
-                else:
-                    with hq as code:
-                        return (TCOType.CALL,
-                                ast_literal[func],
-                                ast_literal[ast.List(args, ast.Load())],
-                                ast_literal[kwargs or ast.Dict([], [])])
-
-                return code
-            else:
-                return tree
+    def return_replacer(tree, set_ctx, set_ctx_for, stop, in_loop=False,
+                        **kw):
+        if isinstance(tree, compat.scope_nodes + (ast.Lambda,)):
+            stop()
+            return tree
+        if isinstance(tree, (ast.For, ast.AsyncFor, ast.While)):
+            set_ctx(in_loop=True)
+        if isinstance(tree, ast.Try):
+            # ``continue`` isn't allowed in a ``finally`` clause before
+            # Python 3.8
+            set_ctx_for(tree.finalbody, in_loop=True)
+        if isinstance(tree, ast.Return):
+            call = tail_call(tree.value, is_async)
+            if call is not None:
+                code = self_call(call, in_loop)
+                if code is not None:
+                    return code
+                bounces[0] = True
+                return bounce(hq[TCOType.CALL], call)
+        return tree
 
     # Replace calls (that aren't returned) which happen to be in a tail-call
     # position
     def replace_tc_pos(node):
+        call = None
+        if isinstance(node, ast.Expr):
+            call = tail_call(node.value, is_async)
+        if call is not None:
+            if returns_none(tree):
+                code = self_call(call, False)
+                if code is not None:
+                    return code
+            bounces[0] = True
+            return bounce(hq[TCOType.IGNORE], call)
         with switch(node):
-            if ast.Expr(value=ast.Call(
-                    func=func,
-                    args=args,
-                    keywords=keywords)):
-                starred = [arg for arg in args if isinstance(arg, ast.Starred)]
-                kwargs = [kw for kw in keywords if kw.arg is None]
-
-                if len(kwargs):
-                    kwargs = kwargs[0].value
-                if len(starred):
-                    starred = starred[0].value
-                    with hq as code:
-                    # get rid of starargs
-                        return (TCOType.IGNORE,
-                                ast_literal[func],
-                                (ast_literal[ast.List(args, ast.Load())] +
-                                 list(ast_literal[starred])),
-                                ast_literal[kwargs or ast.Dict([],[])])
-                else:
-                    with hq as code:
-                        return (TCOType.IGNORE,
-                                ast_literal[func],
-                                ast_literal[ast.List(args, ast.Load())],
-                                ast_literal[kwargs or ast.Dict([], [])])
-                return code
-            elif ast.If(test=test, body=body, orelse=orelse):
-                body[-1] = replace_tc_pos(body[-1])
+            if ast.If(test=test, body=body, orelse=orelse):
+                body[-1:] = as_list(replace_tc_pos(body[-1]))
                 if orelse:
-                    orelse[-1] = replace_tc_pos(orelse[-1])
+                    orelse[-1:] = as_list(replace_tc_pos(orelse[-1]))
                 return ast.If(test, body, orelse)
             else:
                 return node
 
-    tree = return_replacer.recurse(tree)
+    tree.body = return_replacer.recurse(tree.body)
+    tree.body[-1:] = as_list(replace_tc_pos(tree.body[-1]))
 
-    tree.decorator_list = ([hq[trampoline_decorator]] +
-                           tree.decorator_list)
+    if looped[0]:
+        docstring = []
+        if (isinstance(tree.body[0], ast.Expr) and
+                isinstance(tree.body[0].value, ast.Str)):
+            docstring = tree.body[:1]
+            tree.body = tree.body[1:]
+        if not isinstance(tree.body[-1], ast.Return):
+            tree.body.append(ast.Return(None))
+        tree.body = docstring + [ast.While(ast.NameConstant(True),
+                                           tree.body, [])]
 
-    tree.body[-1] = replace_tc_pos(tree.body[-1])
+    if bounces[0]:
+        if is_async:
+            decorator = hq[async_trampoline_decorator]
+        else:
+            decorator = hq[trampoline_decorator]
+        tree.decorator_list = [decorator] + tree.decorator_list
     return tree
+
+
+def as_list(node):
+    return node if isinstance(node, list) else [node]
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 from ast import BinOp
+from collections import namedtuple
 import unittest
+from unittest import mock
 
+from macropy.case_classes import macros, case  # noqa: F401
 from macropy.experimental.pattern import (  # noqa: F401
     macros, _matching, switch, patterns, LiteralMatcher, TupleMatcher,
     PatternMatchException, NameMatcher, ListMatcher, PatternVarConflict,
-    ClassMatcher, PatternVarMismatch)
+    ClassMatcher, PatternVarMismatch, field_names)
 
 
 class Foo(object):
@@ -29,6 +32,11 @@ class Bob(object):
         self.c = c
 
 
+@case
+class Point(x, y | 0, [rest]):  # noqa: F821
+    pass
+
+
 class Screwy(object):
     def __init__(self, a, b):
         self.x = a
@@ -161,6 +169,78 @@ class Tests(unittest.TestCase):
         self.assertTrue(reached_end)
         self.assertEquals(3, branch_reached)
 
+    def test_switch_does_not_raise(self):
+        raised = []
+
+        def init(self, *args):
+            raised.append(args)
+
+        values = []
+        with mock.patch.object(PatternMatchException, '__init__', init):
+            for value in [Foo(1, 2), Bar(3), Baz([4, 5]), Baz((6,)), 7]:
+                with switch(value):
+                    if Foo(x, 3) | Foo(x, 2):
+                        values.append(x)
+                    elif Bar(4):
+                        values.append(None)
+                    elif Baz([x, y]):
+                        values.append(x + y)
+                    elif Baz((x,)):
+                        values.append(x)
+                    elif Bar(x):
+                        values.append(-x)
+                        continue
+                    else:
+                        break
+        self.assertEquals([1, -3, 9, 6], values)
+        self.assertEquals([], raised)
+
+    def test_switch_decision_tree(self):
+        unapplied = []
+
+        class Pair(object):
+            @classmethod
+            def __unapply__(clazz, val, kw_args):
+                unapplied.append(val)
+                if not isinstance(val, tuple) or len(val) != 2:
+                    raise PatternMatchException()
+                return (list(val), {})
+
+        def describe(value):
+            del unapplied[:]
+            with switch(value):
+                if Pair(0, (x, 0)):
+                    return 'x-axis', x
+                elif Pair(0, (0, y)):
+                    return 'y-axis', y
+                elif Bar(x):
+                    return 'bar', x
+                elif Pair(0, (x, y)):
+                    return 'plane', x, y
+                elif Pair(x, _):
+                    return 'other', x
+
+        self.assertEquals(('x-axis', 1), describe((0, (1, 0))))
+        self.assertEquals(('y-axis', 2), describe((0, (0, 2))))
+        self.assertEquals(('plane', 1, 2), describe((0, (1, 2))))
+        self.assertEquals(1, len(unapplied))
+        self.assertEquals(('other', 1), describe((1, 2)))
+        bar = Bar(3)
+        self.assertEquals(('bar', 3), describe(bar))
+        self.assertEquals([bar], unapplied)
+        self.assertIsNone(describe(3))
+
+    def test_switch_body_exceptions(self):
+        branch_reached = -1
+        with self.assertRaises(PatternMatchException):
+            with switch(Bar(1)):
+                if Bar(x):
+                    branch_reached = 1
+                    raise PatternMatchException()
+                else:
+                    branch_reached = 2
+        self.assertEquals(1, branch_reached)
+
     def test_patterns_macro(self):
         blah = Baz(5)
         branch_reached = -1
@@ -174,6 +254,18 @@ class Tests(unittest.TestCase):
                 branch_reached = 3
         self.assertEquals(3, branch_reached)
 
+    def test_patterns_plain_conditions(self):
+        results = []
+        for value in [Baz(1), Bar(2), Bar(3)]:
+            with patterns:
+                if Baz(x) << value:
+                    results.append(x)
+                elif value.a == 2:
+                    results.append('two')
+                elif Bar(x) << value:
+                    results.append(-x)
+        self.assertEquals([1, 'two', -3], results)
+
     def test_keyword_matching(self):
         foo = Foo(21, 23)
         with patterns:
@@ -195,6 +287,23 @@ class Tests(unittest.TestCase):
         self.assertEquals(4, op)
         self.assertEquals(5, y)
 
+    def test_positional_ast_matching(self):
+        binop_ast = BinOp(3, 4, 5)
+        with patterns:
+            BinOp(x, op, y) << binop_ast
+        self.assertEquals((3, 4, 5), (x, op, y))
+
+    def test_field_names(self):
+        Pair = namedtuple('Pair', ['first', 'second'])
+        self.assertEquals(('x', 'y'), field_names(Foo))
+        self.assertEquals(('first', 'second'), field_names(Pair))
+        self.assertEquals(('left', 'op', 'right'), field_names(BinOp))
+        self.assertEquals(('a',), field_names(Bar))
+        self.assertEquals(('x', 'y'), field_names(Point))
+        with _matching:
+            Pair(x, Pair(second=y)) << Pair(1, Pair(2, 3))
+        self.assertEquals((1, 3), (x, y))
+
     def test_unapply_matching(self):
         class Even:
             @classmethod
@@ -224,6 +333,31 @@ class Tests(unittest.TestCase):
             self.assertEquals(4, a)
             self.assertEquals(5, b)
 
+    def test_compiled_matching(self):
+        with _matching:
+            [Foo(x, (1, [y, _])), Bar(a=z)] << [Foo(2, (1, [3, 4])), Bar(5)]
+        self.assertEquals((2, 3, 5), (x, y, z))
+
+        with self.assertRaises(PatternMatchException):
+            with _matching:
+                [Foo(x, (1, [y, _]))] << [Foo(2, (1, [3]))]
+        with self.assertRaises(PatternMatchException):
+            with _matching:
+                Bar(x, y) << Bar(1)
+        self.assertEquals((2, 3), (x, y))
+
+    def test_matching_evaluates_value_once(self):
+        values = []
+
+        def value():
+            values.append(1)
+            return Foo((4, 5), 6)
+
+        with _matching:
+            Foo((a, b) & c, d) << value()
+        self.assertEquals(((4, 5), 4, 5, 6), (c, a, b, d))
+        self.assertEquals([1], values)
+
     # this doesn't work yet
     # def test_wildcard_matching_multiple(self):
     #     with _matching:
@@ -1,10 +1,19 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import os
+import shutil
+import tempfile
+import threading
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-from sqlalchemy import create_engine, func
+from sqlalchemy import create_engine, event, func
 
-from macropy.experimental.pinq import macros, sql, query, generate_schema
+from macropy.experimental.pinq import (
+    macros, sql, query, async_query, stream, batches, columns,
+    generate_schema)
+from macropy.experimental import pinq
 
 
 engine = create_engine("sqlite://")
@@ -325,3 +334,164 @@ class Tests(unittest.TestCase):
                 .limit(10)
             ]
         )
+
+    def test_compiled_query(self):
+        def larger_than(area, names):
+            return query[(
+                x.name for x in db.country
+                if x.surface_area > area * 1000
+                if x.name in names
+            )]
+
+        names = ['Canada', 'China', 'France', 'Russian Federation']
+        self.assertEqual([('Canada',), ('China',), ('Russian Federation',)],
+                         sorted(larger_than(9000, names)))
+        compiled = len(pinq.compiled_cache)
+        # the area becomes a bind parameter of the same statement
+        self.assertEqual([('Russian Federation',)], larger_than(10000, names))
+        self.assertEqual(sorted((n,) for n in names),
+                         sorted(larger_than(0, names)))
+        self.assertEqual(compiled, len(pinq.compiled_cache))
+        # while other values give another statement
+        self.assertEqual([('France',)], larger_than(0, ['France']))
+        self.assertEqual(compiled + 1, len(pinq.compiled_cache))
+
+        # the statement isn't kept for values which may change in place
+        areas = {'France': 551500}
+        names = areas.keys()
+        self.assertEqual([('France',)], larger_than(0, names))
+        areas['Canada'] = 9970610
+        self.assertEqual([('Canada',), ('France',)],
+                         sorted(larger_than(0, names)))
+
+        def in_continent(continent):
+            return sql[(c.name for c in db.country.alias('c')
+                        if c.continent == continent)]
+
+        europe, asia = in_continent('Europe'), in_continent('Asia')
+        compare_queries(
+            "SELECT name FROM country WHERE continent = 'Europe'", europe)
+        compare_queries(
+            "SELECT name FROM country WHERE continent = 'Asia'", asia)
+        self.assertEqual(str(europe), str(asia))
+
+    def test_streaming(self):
+        def cities(minimum):
+            return stream(100)[(
+                (t.name, t.population) for t in db.city
+                if t.population > minimum
+            )]
+
+        everything = query[(
+            (t.name, t.population) for t in db.city if t.population > 0)]
+        rows = cities(0)
+        self.assertEqual(everything, list(rows))
+
+        sizes = [len(rows) for rows in batches(300)[(
+            t.name for t in db.city if t.population > 0)]]
+        self.assertEqual(len(everything), sum(sizes))
+        self.assertEqual({300}, set(sizes[:-1]))
+
+        # abandoning the iteration closes the result
+        rows = cities(1000000)
+        first = next(rows)
+        self.assertEqual([r for r in everything if r[1] > 1000000][0], first)
+        rows.close()
+
+        names, populations = columns(7)[(
+            (t.name, t.population) for t in db.city if t.population > 0)]
+        self.assertEqual([name for name, _ in everything], names)
+        self.assertEqual([p for _, p in everything], populations)
+        self.assertEqual([[]], columns[(
+            t.name for t in db.city if t.population < 0)])
+
+    def test_async_query(self):
+        # an in-memory database would be another one in each thread
+        directory = tempfile.mkdtemp()
+        try:
+            engine = create_engine(
+                "sqlite:///" + os.path.join(directory, "numbers.db"))
+            engine.execute("CREATE TABLE numbers (n INTEGER)")
+            engine.execute("INSERT INTO numbers VALUES (?)",
+                           [(i,) for i in range(100)])
+            numbers = generate_schema(engine).numbers
+            threads = set()
+            event.listen(engine, 'before_cursor_execute',
+                         lambda *args: threads.add(threading.get_ident()))
+
+            def first(k, executor=None):
+                return async_query(executor)[(
+                    x.n for x in numbers if x.n < k)]
+
+            async def gather(executor=None):
+                return await asyncio.gather(
+                    *[first(k, executor) for k in range(20)])
+
+            expected = [[(i,) for i in range(k)] for k in range(20)]
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                self.assertEqual(expected, loop.run_until_complete(gather()))
+                with ThreadPoolExecutor(4) as executor:
+                    self.assertEqual(expected, loop.run_until_complete(
+                        gather(executor)))
+                self.assertEqual([(0,)], loop.run_until_complete(
+                    async_query[(x.n for x in numbers if x.n < 1)]))
+            finally:
+                asyncio.set_event_loop(None)
+                loop.close()
+            # the queries ran outside of the event loop
+            self.assertNotIn(threading.get_ident(), threads)
+            engine.dispose()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_schema_cache(self):
+        directory = tempfile.mkdtemp()
+        try:
+            cached = generate_schema(engine, cache_dir=directory, version=1)
+            self.assertEqual(1, len(os.listdir(directory)))
+            with mock.patch('sqlalchemy.MetaData.reflect') as reflect:
+                loaded = generate_schema(engine, cache_dir=directory,
+                                         version=1)
+                self.assertFalse(reflect.called)
+                generate_schema(engine, cache_dir=directory, version=2)
+                self.assertTrue(reflect.called)
+            self.assertEqual([c.name for c in cached.country.columns],
+                             [c.name for c in loaded.country.columns])
+            # a complete schema has all the tables already
+            with mock.patch('sqlalchemy.Table') as table:
+                self.assertFalse(hasattr(loaded, 'no_such_table'))
+                self.assertFalse(table.called)
+            compare_queries(
+                "SELECT name FROM country WHERE continent = 'Europe'",
+                sql[(x.name for x in loaded.country
+                     if x.continent == 'Europe')])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lazy_schema(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with mock.patch('sqlalchemy.MetaData.reflect') as reflect:
+                lazy = generate_schema(engine, cache_dir=directory,
+                                       lazy=True)
+                self.assertNotIn('city', vars(lazy))
+                self.assertEqual(db.city.columns.keys(),
+                                 lazy.city.columns.keys())
+                # with the table of its foreign key
+                self.assertIn('country', vars(lazy))
+                self.assertNotIn('country_language', vars(lazy))
+                self.assertFalse(hasattr(lazy, 'no_such_table'))
+                self.assertFalse(reflect.called)
+
+                # the tables reflected so far are saved
+                lazy = generate_schema(engine, cache_dir=directory,
+                                       lazy=True)
+                self.assertIn('city', vars(lazy))
+                self.assertNotIn('country_language', vars(lazy))
+            # but don't make a complete schema
+            self.assertIn('country_language', vars(generate_schema(
+                engine, cache_dir=directory)))
+        finally:
+            shutil.rmtree(directory)
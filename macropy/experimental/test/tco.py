@@ -1,3 +1,7 @@
+import asyncio
+import functools
+import sys
+import threading
 import unittest
 from macropy.experimental.tco import macros, tco
 from macropy.case_classes import macros, case
@@ -14,6 +18,113 @@ class Tests(unittest.TestCase):
         self.assertEquals(1, foo(3000))
 
 
+    def test_self_recursion_loop(self):
+        @tco
+        def sum_to(n, total=0):
+            """Sum of the integers up to n"""
+            if n == 0:
+                return total
+            return sum_to(total=total + n, n=n - 1)
+
+        self.assertEquals(5000050000, sum_to(100000))
+        self.assertEquals("Sum of the integers up to n", sum_to.__doc__)
+        # the function is a plain loop, which needs no trampoline
+        self.assertFalse(hasattr(sum_to, 'tco'))
+
+        @tco
+        def count(n, total=0):
+            if n == 0:
+                return total
+            if n % 2:
+                return count(n - 1, total + 1)
+            # omits total, so this goes through the trampoline
+            return count(n - 1)
+
+        self.assertEquals(1, count(5))
+        self.assertEquals(1, count(100000))
+        self.assertTrue(hasattr(count, 'tco'))
+
+    def test_self_recursion_closures(self):
+        @tco
+        def collect(n, funcs):
+            if n == 0:
+                return [f() for f in funcs]
+            return collect(n - 1, funcs + [lambda: n])
+
+        self.assertEquals([3, 2, 1], collect(3, []))
+
+        @tco
+        def first_even(xs, i):
+            for x in xs[i:]:
+                if x % 2:
+                    return first_even(xs, i + 1)
+                return x
+
+        self.assertEquals(4, first_even([1, 3, 5, 4, 7], 0))
+
+    def test_self_recursion_decorated(self):
+        calls = []
+
+        def logged(func):
+            def wrapper(*args):
+                calls.append(args)
+                return func(*args)
+            return wrapper
+
+        @tco
+        @logged
+        def down(n):
+            if n == 0:
+                return 'done'
+            return down(n - 1)
+
+        self.assertEquals('done', down(3))
+        self.assertEquals([(3,), (2,), (1,), (0,)], calls)
+
+        del calls[:]
+
+        @logged
+        @tco
+        def up(n):
+            if n == 3:
+                return 'done'
+            return up(n + 1)
+
+        self.assertEquals('done', up(0))
+        self.assertEquals([(0,), (1,), (2,), (3,)], calls)
+
+        def step(n):
+            return 'outer'
+
+        class Steps(object):
+            @tco
+            def step(n):
+                if n == 0:
+                    return 'inner'
+                # refers to the step function outside of the class
+                return step(n - 1)
+
+            @staticmethod
+            @tco
+            def static_step(n):
+                return step(n)
+
+        self.assertEquals('outer', Steps.step(3))
+        self.assertEquals('inner', Steps.step(0))
+        self.assertEquals('outer', Steps.static_step(3))
+
+    def test_self_recursion_finally(self):
+        @tco
+        def cleanup(n, done):
+            try:
+                done.append(n)
+            finally:
+                if n > 0:
+                    return cleanup(n - 1, done)
+            return done
+
+        self.assertEquals([3, 2, 1, 0], cleanup(3, []))
+
     def test_tco_returns(self):
 
         @case
@@ -97,6 +208,176 @@ class Tests(unittest.TestCase):
 
         self.assertEquals(1, Blah().foo(5000))
 
+    def test_keyword_tailcalls(self):
+        def total(a, b=0, *rest, scale=1, **extra):
+            return (a + b + sum(rest) + sum(extra.values())) * scale
+
+        @tco
+        def f(n):
+            if n == 0:
+                return total(1, 2, *[3, 4], scale=2, **{'e': 5})
+            return f(n=n - 1)
+
+        self.assertEquals(30, f(1000))
+
+    def test_wrapped_tailcalls(self):
+        calls = []
+
+        def logged(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                calls.append(args)
+                return func(*args)
+            return wrapper
+
+        @logged
+        @tco
+        def even(n):
+            if n == 0:
+                return True
+            return odd(n - 1)
+
+        @tco
+        def odd(n):
+            if n == 0:
+                return False
+            return even(n - 1)
+
+        self.assertTrue(even(6))
+        self.assertEquals([(6,), (4,), (2,), (0,)], calls)
+
+        del calls[:]
+
+        def async_logged(func):
+            @functools.wraps(func)
+            async def wrapper(*args):
+                calls.append(args)
+                return await func(*args)
+            return wrapper
+
+        @async_logged
+        @tco
+        async def async_even(n):
+            if n == 0:
+                return True
+            return await async_odd(n - 1)
+
+        @tco
+        async def async_odd(n):
+            if n == 0:
+                return False
+            return await async_even(n - 1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertTrue(loop.run_until_complete(async_even(6)))
+        finally:
+            loop.close()
+        self.assertEquals([(6,), (4,), (2,), (0,)], calls)
+
+    def test_concurrent_trampolines(self):
+        @tco
+        def is_even(n):
+            if n == 0:
+                return True
+            return is_odd(n - 1)
+
+        @tco
+        def is_odd(n):
+            if n == 0:
+                return False
+            return is_even(n - 1)
+
+        @tco
+        def count_evens(n, total):
+            if n == 0:
+                return total
+            # a nested trampoline, which runs to completion first
+            if is_even(n % 50):
+                total += 1
+            return count_evens(n - 1, total)
+
+        def work(i, results):
+            results[i] = (is_even(20000 + i), count_evens(5000, 0))
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            results = [None] * 8
+            threads = [threading.Thread(target=work, args=(i, results))
+                       for i in range(len(results))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEquals([(i % 2 == 0, 2500) for i in range(8)], results)
+
+    def test_async_tailcalls(self):
+        @tco
+        async def is_even(n):
+            if n == 0:
+                return True
+            return await is_odd(n - 1)
+
+        @tco
+        async def is_odd(n):
+            if n == 0:
+                return False
+            return await is_even(n - 1)
+
+        @tco
+        async def sum_to(n, total=0):
+            if n == 0:
+                # a tail call to a coroutine function without @tco
+                return await asyncio.sleep(0, result=total)
+            return await sum_to(n - 1, total + n)
+
+        @tco
+        async def count(n, total=0):
+            if n == 0:
+                return total
+            return await count(n - 1, total + 1)
+
+        log = []
+
+        async def record(n):
+            log.append(n)
+
+        @tco
+        async def countdown(n):
+            if n == 0:
+                await record(0)
+            else:
+                log.append(n)
+                await countdown(n - 1)
+
+        class Counter(object):
+            @tco
+            async def count(self, n, total=0):
+                if n == 0:
+                    return total
+                return await self.count(n - 1, total=total + 1)
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertTrue(loop.run_until_complete(is_even(100000)))
+            self.assertFalse(loop.run_until_complete(is_odd(100000)))
+            self.assertEquals(5000050000,
+                              loop.run_until_complete(sum_to(100000)))
+            self.assertEquals(100000, loop.run_until_complete(count(100000)))
+            self.assertIsNone(loop.run_until_complete(countdown(10000)))
+            self.assertEquals(list(range(10000, -1, -1)), log)
+            self.assertEquals(
+                50000, loop.run_until_complete(Counter().count(50000)))
+        finally:
+            loop.close()
+        self.assertTrue(asyncio.iscoroutinefunction(is_even))
+        self.assertTrue(hasattr(sum_to, 'async_tco'))
+        # self-recursion is a plain loop, which needs no trampoline
+        self.assertFalse(hasattr(count, 'async_tco'))
+
     def test_cross_calls(self):
         def odd(n):
             if n == 0:
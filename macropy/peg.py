@@ -3,7 +3,9 @@
 
 import ast
 from collections import defaultdict
+import multiprocessing
 import re
+import threading
 
 import macropy.core.macros
 import macropy.core.util
@@ -112,8 +114,36 @@ def cut():
     of the error messages."""
 
 
+# guards the lazy resolution and analysis of grammars, see `analyze`
+_grammar_lock = threading.RLock()
+
+
+class ParseContext(object):
+    """State shared by every Input derived from the same top-level parse.
+
+    memo: results of left-recursive rules, keyed on (id(rule), index)
+    pending: the keys of `memo` whose seed is currently being grown
+    growing: for each seed being grown, innermost last, the pending keys
+             its current parse has used
+    """
+    __slots__ = ['memo', 'pending', 'growing']
+
+    def __init__(self):
+        self.memo = {}
+        self.pending = set()
+        self.growing = []
+
+    def __repr__(self):
+        return "ParseContext()"
+
+
 @case
-class Input(string, index):  # noqa: F821
+class Input(string, index, context | None):  # noqa: F821
+    """
+    string: the whole string being parsed
+    index: the position of the first unread character
+    context: the ParseContext of the parse this Input belongs to
+    """
     pass
 
 
@@ -128,11 +158,12 @@ class Success(output, bindings, remaining):  # noqa: F821
 
 
 @case
-class Failure(remaining, failed, fatal | False):  # noqa: F821
+class Failure(remaining, stack, fatal | False):  # noqa: F821
     """
     remaining: an Input representing the unread portion of the input
-    failed: a List[Parser], containing the stack of parsers in
-            effect at time of failure
+    stack: the parsers in effect at time of failure, outermost first, kept
+           as a linked chain of `(parser, rest)` pairs ending in `None` so
+           that parent parsers can push themselves on it in constant time
     fatal: whether a parent parser which receives this result from a child
            should continue backtracking
     """
@@ -140,6 +171,17 @@ class Failure(remaining, failed, fatal | False):  # noqa: F821
     def index(self):
         return self.remaining.index
 
+    @property
+    def failed(self):
+        """A List[Parser], containing the stack of parsers in effect at time
+        of failure"""
+        failed = []
+        node = self.stack
+        while node is not None:
+            failed.append(node[0])
+            node = node[1]
+        return failed
+
     @property
     def trace(self):
         return [x for f in self.failed for x in f.trace_name]
@@ -181,7 +223,7 @@ class ParseError(Exception):
 class Parser:
     def parse(self, string):
         """String -> value; throws ParseError in case of failure"""
-        res = Parser.Full(self).parse_input(Input(string, 0))
+        res = Parser.Full(self).parse_input(Input(string, 0, ParseContext()))
         if type(res) is Success:
             return res.output
         else:
@@ -189,19 +231,101 @@ class Parser:
 
     def parse_partial(self, string):
         """String -> Success | Failure"""
-        return self.parse_input(Input(string, 0))
+        return self.parse_input(Input(string, 0, ParseContext()))
 
     def parse_string(self, string):
         """String -> Success | Failure"""
-        return Parser.Full(self).parse_input(Input(string, 0))
+        return Parser.Full(self).parse_input(Input(string, 0, ParseContext()))
+
+    def parse_many(self, string, boundary, processes=None,
+                   chunk_size=1 << 20):
+        """String -> [Success | Failure], for a string made of records which
+        this parser matches, each followed by a match of the `boundary`
+        parser or by the end of the string.
+
+        The string is cut in chunks of about `chunk_size` characters at
+        matches of `boundary`, which must therefore never match inside a
+        record, and the chunks are parsed by a pool of `processes` worker
+        processes (by default, as many as there are cpus). After a record
+        fails, parsing resumes after the next match of `boundary`. All the
+        results have indexes into the whole string.
+
+        The workers are forked, inheriting the grammar; without `fork` the
+        chunks are parsed in this process. Each call forks its own pool,
+        as the grammar cannot be sent to existing workers. The outputs of
+        the records are sent back pickled, and their bindings are not
+        kept; the failures are sent back as their index and the positions
+        of the parsers of their stack in the grammar, and are rebuilt with
+        the parsers of this process."""
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        bounds = []
+        start = 0
+        while start < len(string):
+            end = len(string)
+            if start + chunk_size < len(string):
+                end = _find_boundary(boundary, string, start + chunk_size)
+            bounds.append((start, end))
+            start = end
+
+        results = []
+        if not (processes > 1 and len(bounds) > 1 and
+                'fork' in multiprocessing.get_all_start_methods()):
+            for offset, end in bounds:
+                for start, res, next in _parse_records(
+                        self, boundary, string[offset:end]):
+                    remaining = Input(
+                        string, offset + res.remaining.index, None)
+                    if type(res) is Success:
+                        results.append(Success(res.output, {}, remaining))
+                    else:
+                        results.append(Failure(remaining, res.stack,
+                                               res.fatal))
+            return results
+
+        parsers = _reachable([self, boundary])
+        job = self, boundary, string, parsers
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes, _init_worker, (job,)) as pool:
+            chunks = pool.map(_parse_chunk, bounds, 1)
+
+        for (offset, end), chunk in zip(bounds, chunks):
+            for index, output, path, fatal in chunk:
+                remaining = Input(string, offset + index, None)
+                if path is None:
+                    results.append(Success(output, {}, remaining))
+                    continue
+                stack = None
+                for position in reversed(path):
+                    stack = (parsers[position], stack)
+                results.append(Failure(remaining, stack, fatal))
+        return results
 
     def parse_input(self, input):
-        """Input -> Success | Failure"""
+        """Input -> Success | Failure
+
+        The result is always a new object, owned by the caller, which is
+        free to update it in place."""
 
     @property
     def trace_name(self):
         return []
 
+    @property
+    def sub_parsers(self):
+        """The parsers this parser may delegate to"""
+        return []
+
+    def first_info(self, info):
+        """Returns (nullable, opaque, first) for this parser, given the
+        current approximation `info` for its sub-parsers; see `analyze`."""
+        return True, True, frozenset()
+
+    def leftmost(self, info):
+        """The sub-parsers which may be invoked without consuming any input
+        first"""
+        return self.sub_parsers
+
     def bind_to(self, string):
         return Parser.Named(lambda: self, [string])
 
@@ -250,22 +374,34 @@ class Parser:
         def parse_input(self, input):
             res = self.parser.parse_input(input)
             if type(res) is Success and res.remaining.index < len(input.string):
-                return Failure(res.remaining, [self])
+                return Failure(res.remaining, (self, None))
             else:
                 return res
         def short_str(self):
             return self.parser.short_str()
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
+        def first_info(self, info):
+            return info(self.parser)
+
     class Raw(string):
         def parse_input(self, input):
-            if input.string[input.index:].startswith(self.string):
+            if input.string.startswith(self.string, input.index):
                 return Success(self.string, {}, input.copy(index = input.index + len(self.string)))
             else:
-                return Failure(input, [self])
+                return Failure(input, (self, None))
 
         def short_str(self):
             return repr(self.string)
 
+        def first_info(self, info):
+            if self.string == "":
+                return True, False, frozenset()
+            return False, False, frozenset(self.string[0])
+
     class Regex(regex_string):
         def parse_input(self, input):
             match = re.match(self.regex_string, input.string[input.index:])
@@ -274,7 +410,7 @@ class Parser:
                 return Success(group, {},
                                input.copy(index=input.index + len(group)))
             else:
-                return Failure(input, [self])
+                return Failure(input, (self, None))
 
         def short_str(self):
             return repr(self.regex_string) + ".r"
@@ -293,7 +429,7 @@ class Parser:
 
                     if type(res) is Failure:
                         if committed or res.fatal:
-                            return Failure(res.remaining, [self] + res.failed, True)
+                            return Failure(res.remaining, (self, res.stack), True)
                         else:
                             return res
 
@@ -307,23 +443,99 @@ class Parser:
         def short_str(self):
             return "(" + ", ".join(map(lambda x: x.short_str(), self.children)) + ")"
 
+        @property
+        def sub_parsers(self):
+            return [child for child in self.children if child is not cut]
+
+        def first_info(self, info):
+            opaque = False
+            first = frozenset()
+            for child in self.children:
+                if child is cut:
+                    # a failure right after a leading cut is fatal, so the
+                    # Seq cannot be skipped even if it cannot match
+                    return True, True, first
+                child_nullable, child_opaque, child_first = info(child)
+                opaque = opaque or child_opaque
+                first = first | child_first
+                if not child_nullable:
+                    return False, opaque, first
+            return True, opaque, first
+
+        def leftmost(self, info):
+            leftmost = []
+            for child in self.sub_parsers:
+                leftmost.append(child)
+                if not info(child)[0]:
+                    break
+            return leftmost
+
     class Or(children):  # noqa: F821
+        self.dispatch = None  # noqa: F821
+        self.fallback = None  # noqa: F821
+
         def parse_input(self, input):
-            for child in self.children:
+            if self.dispatch is None:
+                analyze(self)
+            if input.index < len(input.string):
+                children = self.dispatch.get(input.string[input.index],
+                                             self.fallback)
+            else:
+                children = self.fallback
+
+            for child in children:
                 res = child.parse_input(input)
 
                 if type(res) is Success:
                     return res
                 elif res.fatal:
-                    res.failed = [self] + res.failed
+                    res.stack = (self, res.stack)
                     return res
-            return Failure(input, [self])
+            return Failure(input, (self, None))
 
         def __or__(self, other): return Parser.Or(self.children + [other])
 
         def short_str(self):
             return "(" + " | ".join(map(lambda x: x.short_str(), self.children)) + ")"
 
+        @property
+        def sub_parsers(self):
+            return self.children
+
+        def first_info(self, info):
+            nullable, opaque, first = False, False, frozenset()
+            for child in self.children:
+                child_nullable, child_opaque, child_first = info(child)
+                nullable = nullable or child_nullable
+                opaque = opaque or child_opaque
+                first = first | child_first
+            return nullable, opaque, first
+
+        def build_dispatch(self, info):
+            """Maps each possible next character to the alternatives which
+            may succeed on it, keeping their order; `fallback` holds the
+            alternatives that must be tried on any other input."""
+            infos = [info(child) for child in self.children]
+            chars = set()
+            for nullable, opaque, first in infos:
+                chars.update(first)
+            fallback = tuple(
+                child for child, (nullable, opaque, first)
+                in zip(self.children, infos)
+                if nullable or opaque
+            )
+            dispatch = {
+                char: tuple(
+                    child for child, (nullable, opaque, first)
+                    in zip(self.children, infos)
+                    if nullable or opaque or char in first
+                )
+                for char in chars
+            }
+            # `dispatch` is what parse_input checks, so it goes last
+            self.fallback = fallback
+            self.dispatch = dispatch
+
     class And(children):  # noqa: F821
         def parse_input(self, input):
             results = [child.parse_input(input) for child in self.children]
@@ -331,7 +543,7 @@ class Parser:
             if failures == []:
                 return results[0]
             else:
-                failures[0].failed = [self] + failures[0].failed
+                failures[0].stack = (self, failures[0].stack)
                 return failures[0]
 
         def __and__(self, other): return Parser.And(self.children + [other])
@@ -339,16 +551,33 @@ class Parser:
         def short_str(self):
             return "(" + " & ".join(map(lambda x: x.short_str(), self.children)) + ")"
 
+        @property
+        def sub_parsers(self):
+            return self.children
+
+        def first_info(self, info):
+            infos = [info(child) for child in self.children]
+            first = infos[0][2]
+            for nullable, opaque, child_first in infos[1:]:
+                first = first & child_first
+            restricted = all(not nullable and not opaque
+                             for nullable, opaque, _ in infos)
+            return infos[0][0], not restricted, first
+
     class Not(parser):  # noqa: F821
         def parse_input(self, input):
             if type(self.parser.parse_input(input)) is Success:
-                return Failure(input, [self])
+                return Failure(input, (self, None))
             else:
                 return Success(None, {}, input)
 
         def short_str(self):
             return "-" + self.parser.short_str()
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
     class Rep(parser):  # noqa: F821
         def parse_input(self, input):
             current_input = input
@@ -359,7 +588,7 @@ class Parser:
                 res = self.parser.parse_input(current_input)
                 if type(res) is Failure:
                     if res.fatal:
-                        res.failed = [self] + res.failed
+                        res.stack = (self, res.stack)
                         return res
                     else:
                         return Success(results, result_dict, current_input)
@@ -371,6 +600,14 @@ class Parser:
 
                 results.append(res.output)
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
+        def first_info(self, info):
+            nullable, opaque, first = info(self.parser)
+            return True, opaque, first
+
     class RepN(parser, n):  # noqa: F821
         def parse_input(self, input):
             current_input = input
@@ -380,7 +617,7 @@ class Parser:
             for i in range(self.n):
                 res = self.parser.parse_input(current_input)
                 if type(res) is Failure:
-                    res.failed = [self] + res.failed
+                    res.stack = (self, res.stack)
                     return res
 
                 current_input = res.remaining
@@ -395,6 +632,14 @@ class Parser:
         def short_str(self):
             return self.parser.short_str() + "*" + n
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
+        def first_info(self, info):
+            nullable, opaque, first = info(self.parser)
+            return nullable or self.n == 0, opaque, first
+
     class Transform(parser, func):  # noqa: F821
         def parse_input(self, input):
             res = self.parser.parse_input(input)
@@ -402,12 +647,19 @@ class Parser:
             if type(res) is Success:
                 res.output = self.func(res.output)
             else:
-                res.failed = [self] + res.failed
+                res.stack = (self, res.stack)
             return res
 
         def short_str(self):
             return self.parser.short_str()
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
+        def first_info(self, info):
+            return info(self.parser)
+
     class TransformBound(parser, func):  # noqa: F821
         def parse_input(self, input):
             res = self.parser.parse_input(input)
@@ -415,39 +667,261 @@ class Parser:
                 res.output = self.func(**res.bindings)
                 res.bindings = {}
             else:
-                res.failed = [self] + res.failed
+                res.stack = (self, res.stack)
             return res
 
         def short_str(self):
             return self.parser.short_str()
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
+        def first_info(self, info):
+            return info(self.parser)
+
     class Named(parser_thunk, trace_name):  # noqa: F821
         self.stored_parser = None  # noqa: F821
+        self.left_recursive = None  # noqa: F821
 
         @property
         def parser(self):
-            if not self.stored_parser:
-                self.stored_parser = self.parser_thunk()
+            if self.stored_parser is None:
+                with _grammar_lock:
+                    if self.stored_parser is None:
+                        self.stored_parser = self.parser_thunk()
             return self.stored_parser
 
         def parse_input(self, input):
+            if self.left_recursive is None:
+                analyze(self)
+            if self.left_recursive:
+                return self.grow_seed(input)
+            return self.parse_rule(input)
+
+        def parse_rule(self, input):
             res = self.parser.parse_input(input)
             if type(res) is Success:
                 res.bindings = {self.trace_name[0]: res.output}
             else:
-                res.failed = [self] + res.failed
+                res.stack = (self, res.stack)
             return res
 
+        def grow_seed(self, input):
+            """Parses a left-recursive rule by first letting the recursive
+            invocations fail, then re-parsing with the last result memoized
+            for as long as that makes the match longer."""
+            if input.context is None:
+                input = input.copy(context=ParseContext())
+            context = input.context
+            memo = context.memo
+            key = (id(self), input.index)
+            if key in memo:
+                if key in context.pending:
+                    context.growing[-1].add(key)
+                return memo[key].copy()
+
+            memo[key] = Failure(input, (self, None))
+            context.pending.add(key)
+            context.growing.append(set())
+            res = self.parse_rule(input)
+            while (type(res) is Success and
+                   (type(memo[key]) is Failure or
+                    res.remaining.index > memo[key].remaining.index)):
+                memo[key] = res
+                res = self.parse_rule(input)
+            context.pending.remove(key)
+            depends = context.growing.pop()
+            depends.discard(key)
+
+            seed = memo[key]
+            if type(seed) is Failure:
+                seed = res
+            if depends:
+                # built on the seeds of enclosing rules which are still
+                # growing: it must be parsed again when those grow
+                del memo[key]
+                context.growing[-1].update(depends)
+                return seed
+            memo[key] = seed
+            return seed.copy()
+
         def short_str(self):
             return self.trace_name[0]
 
+        @property
+        def sub_parsers(self):
+            return [self.parser]
+
+        def first_info(self, info):
+            return info(self.parser)
+
     class Succeed(string):  # noqa: F821
         def parse_input(self, input):
             return Success(self.string, {}, input)
 
     class Fail():
         def parse_input(self, input):
-            return Failure(input, [self])
+            return Failure(input, (self, None))
 
         def short_str(self):
             return "fail"
+
+        def first_info(self, info):
+            return False, False, frozenset()
+
+
+# the (record, boundary, string, parsers) parsed by a parse_many worker,
+# set in the worker process only
+_worker_job = None
+
+
+def _init_worker(job):
+    global _worker_job
+    _worker_job = job
+
+
+def _find_boundary(boundary, string, start, window=4096):
+    """The index right after the first non-empty match of `boundary` at or
+    after `start`, or the length of the string.
+
+    The search goes through growing, overlapping windows of the string, as
+    some parsers copy the string from the index they start at; a match
+    must end before the end of its window, so it cannot have been cut
+    short."""
+    while start < len(string):
+        chunk = string[start:start + window]
+        last = start + len(chunk) == len(string)
+        context = ParseContext()
+        for index in range(len(chunk)):
+            res = boundary.parse_input(Input(chunk, index, context))
+            if type(res) is Success and index < res.remaining.index:
+                if res.remaining.index < len(chunk) or last:
+                    return start + res.remaining.index
+                break
+        else:
+            if last:
+                break
+            index = len(chunk) // 2
+        start += max(index, 1)
+        window *= 2
+    return len(string)
+
+
+def _parse_records(record, boundary, string):
+    """[(start, res, next)] for each record of `string`, where `res` is the
+    Success | Failure of the record starting at `start`, and the following
+    record starts at `next`"""
+    records = []
+    index = 0
+    while index < len(string):
+        res = record.parse_input(Input(string, index, ParseContext()))
+        next = None
+        if type(res) is Success:
+            if res.remaining.index == len(string):
+                next = len(string)
+            else:
+                sep = boundary.parse_input(res.remaining)
+                if type(sep) is Success and sep.remaining.index > index:
+                    next = sep.remaining.index
+                elif type(sep) is Success:
+                    res = Failure(res.remaining, (boundary, None))
+                else:
+                    res = sep
+        if next is None:
+            next = _find_boundary(boundary, string, max(res.index, index))
+        records.append((index, res, next))
+        index = next
+    return records
+
+
+def _parse_chunk(bounds):
+    """Parses string[start:end] of the parse_many job of this worker,
+    returning for each record (index, output, path, fatal) with the index
+    the record ends at, or fails at, relative to the chunk. `path` is None
+    for successes, and the positions in `parsers` of the stack of the
+    failures, which cannot be sent back as they are."""
+    record, boundary, string, parsers = _worker_job
+    positions = {id(parser): i for i, parser in enumerate(parsers)}
+    start, end = bounds
+    chunk = []
+    for index, res, next in _parse_records(record, boundary,
+                                           string[start:end]):
+        if type(res) is Success:
+            chunk.append((res.remaining.index, res.output, None, False))
+            continue
+        path = []
+        node = res.stack
+        while node is not None:
+            path.append(positions[id(node[0])])
+            node = node[1]
+        chunk.append((res.remaining.index, None, path, res.fatal))
+    return chunk
+
+
+def _reachable(roots):
+    """Every parser reachable from the `roots`, each once, in an order which
+    only depends on the grammar"""
+    parsers = []
+    seen = set()
+    stack = list(reversed(roots))
+    while stack:
+        parser = stack.pop()
+        if id(parser) not in seen:
+            seen.add(id(parser))
+            parsers.append(parser)
+            stack.extend(parser.sub_parsers)
+    return parsers
+
+
+def analyze(root):
+    """Grammar analysis pass over every parser reachable from `root`.
+
+    Computes, as a fixpoint over the (possibly cyclic) grammar, whether
+    each parser is nullable (may succeed without consuming input), opaque
+    (its first character cannot be predicted, or it may fail fatally
+    without consuming input) and the set of characters a non-empty match
+    may start with. From those it fills in the dispatch tables of the `Or`
+    parsers and flags the left-recursive `Named` rules.
+
+    This runs automatically the first time a grammar is used, and can be
+    called beforehand to prepare it. It is the only place where parsers
+    are modified: it runs under a lock, only fills in parsers which were
+    not analyzed yet, and afterwards the grammar is never written to, so
+    that it can be shared by any number of threads. Everything that
+    pertains to a single parse is kept in its ParseContext and results."""
+    with _grammar_lock:
+        parsers = _reachable([root])
+
+        infos = {id(p): (False, False, frozenset()) for p in parsers}
+        info = f[infos[id(_)]]
+        changed = True
+        while changed:
+            changed = False
+            for parser in parsers:
+                new_info = parser.first_info(info)
+                if new_info != infos[id(parser)]:
+                    infos[id(parser)] = new_info
+                    changed = True
+
+        for parser in parsers:
+            if type(parser) is Parser.Or and parser.dispatch is None:
+                parser.build_dispatch(info)
+            elif (type(parser) is Parser.Named and
+                  parser.left_recursive is None):
+                parser.left_recursive = _reaches(parser, parser, info)
+
+
+def _reaches(start, target, info):
+    """Whether `target` may be invoked by `start` without any input being
+    consumed in between"""
+    seen = set()
+    stack = list(start.leftmost(info))
+    while stack:
+        parser = stack.pop()
+        if parser is target:
+            return True
+        if id(parser) not in seen:
+            seen.add(id(parser))
+            stack.extend(parser.leftmost(info))
+    return False
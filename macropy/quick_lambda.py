@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 import ast
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import types
 
 from .core.macros import Macros, injected_vars, post_processing
-from .core.util import Lazy, register
+from .core.util import Lazy, load_pickle, register, write_atomic
 from .core.quotes import macros, name, q, ast_literal, u
 from .core.hquotes import macros, hq, u  # noqa: F811
 from .core.cleanup import ast_ctx_fixer
@@ -51,6 +57,145 @@ def get_interned(store, index, thunk):
     return store[index][0]
 
 
+def get_shared(store, key, bindings, module, index, thunk):
+    return store.get(store.key(key, bindings, module, index), thunk)
+
+
+def global_name(value):
+    """A name of `value` which is the same in every process: the name of
+    a module, the qualified name of a module level class or function,
+    or the repr of a constant, or None for other values."""
+    kind = type(value)
+    if value is None or kind in (bool, int, float, complex, str, bytes):
+        return repr(value)
+    elif kind is tuple:
+        names = [global_name(item) for item in value]
+        if None not in names:
+            return "(%s)" % ", ".join(names)
+    elif isinstance(value, types.ModuleType):
+        return "module " + value.__name__
+    else:
+        module = getattr(value, '__module__', None)
+        qualname = getattr(value, '__qualname__', None)
+        if isinstance(module, str) and isinstance(qualname, str):
+            found = sys.modules.get(module)
+            for part in qualname.split('.'):
+                found = getattr(found, part, None)
+            if found is value:
+                return "%s.%s" % (module, qualname)
+    return None
+
+
+def free_names(tree):
+    """The sorted names read by the expression `tree` which it doesn't
+    bind itself."""
+    loaded = set()
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                loaded.add(node.id)
+            else:
+                bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+    return sorted(loaded - bound)
+
+
+class InternStore(object):
+    """Interned values shared by the ``interned(store)[...]`` call sites
+    of all the modules, by the key of their expression and the values
+    of its free names.
+
+    The values are kept for the life of the store, with the objects
+    bound to the free names that have no global name, which are pinned
+    as their ids are part of the keys: both grow with each new object
+    a site is evaluated with, so sites whose free names are bound to a
+    new object at each run should not be interned."""
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.RLock()
+        # the values identified by id in the keys, kept so that their
+        # ids are not reused
+        self.pinned = {}
+
+    def key(self, key, bindings, module, index):
+        """The key of the value of the call site `index` of `module`,
+        whose expression has the structural `key` and whose free names
+        and their values are `bindings`: the sites share the value when
+        their names are bound to the same objects."""
+        parts = [key]
+        for name, value in bindings:
+            description = global_name(value)
+            if description is None:
+                self.pinned[id(value)] = value
+                description = "object %d" % id(value)
+            parts.append("%s = %s" % (name, description))
+        return "\n".join(parts)
+
+    def get(self, key, thunk):
+        """The value of `key`, given by `thunk()` the first time."""
+        try:
+            return self.values[key]
+        except KeyError:
+            pass
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = self.load(key, thunk)
+            return self.values[key]
+
+    def load(self, key, thunk):
+        return thunk()
+
+
+class DiskInternStore(InternStore):
+    """An `InternStore` which also pickles the values into the directory
+    `path`, from which the other processes load them rather than
+    evaluating their expression. The `version` is part of the keys, and
+    should change with what the expressions compute. Values which can't
+    be pickled are only kept in memory.
+
+    The sites whose free names are all bound to values with a
+    `global_name` share their value with the other processes, and the
+    others are keyed by their module and position in it."""
+
+    def __init__(self, path, version=None):
+        super(DiskInternStore, self).__init__()
+        self.path = path
+        self.version = version
+
+    def key(self, key, bindings, module, index):
+        parts = [key]
+        for name, value in bindings:
+            description = global_name(value)
+            if description is None:
+                parts = [key, "site %d of %s" % (index, module)]
+                break
+            parts.append("%s = %s" % (name, description))
+        if self.version is not None:
+            parts.append("version %s" % (self.version,))
+        return hashlib.sha1("\n".join(parts).encode('utf-8')).hexdigest()
+
+    def load(self, key, thunk):
+        path = os.path.join(self.path, key + ".pickle")
+        missing = object()
+        value = load_pickle(path, missing)
+        if value is not missing:
+            return value
+        value = thunk()
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return value
+        write_atomic(path, data)
+        return value
+
+
+# The store of the values shared by all the modules of the process
+shared = InternStore()
+
+
 @register(injected_vars)
 def interned_count(**kw):
     return [0]
@@ -77,10 +222,24 @@ def interned_processing(tree, gen_sym, interned_count, interned_name, **kw):
 
 
 @macros.expr
-def interned(tree, interned_name, interned_count, **kw):
-    """Macro to intern the wrapped expression on a per-module basis"""
+def interned(tree, args, interned_name, interned_count, **kw):
+    """Macro to intern the wrapped expression on a per-module basis, or
+    in the `InternStore` given as in ``interned(shared)[...]``, where
+    the call sites with the same expression and the same values of its
+    free names share its value."""
     interned_count[0] += 1
 
     hq[name[interned_name]]
 
-    return hq[get_interned(name[interned_name], interned_count[0] - 1, lambda: ast_literal[tree])]
+    if args:
+        store, = args
+        key = hashlib.sha1(ast.dump(tree).encode('utf-8')).hexdigest()
+        bindings = ast.List([hq[(u[n], name[n])] for n in free_names(tree)],
+                            ast.Load())
+        tree = hq[get_shared(ast_literal[store], u[key],
+                             ast_literal[bindings], name['__name__'],
+                             u[interned_count[0] - 1],
+                             lambda: ast_literal[tree])]
+
+    return hq[get_interned(name[interned_name], u[interned_count[0] - 1],
+                           lambda: ast_literal[tree])]
@@ -1,28 +1,154 @@
 import ast
-import re
 
 import macropy.core
 import macropy.core.macros
 
-from macropy.core.quotes import u, ast_list
-from macropy.core.hquotes import macros, hq
-from macropy.core import ast_repr, Captured
+from macropy.core import compat
 
 macros = macropy.core.macros.Macros()
 
+CONVERSIONS = {'s': ord('s'), 'r': ord('r'), 'a': ord('a')}
+CONVERTERS = {'s': str, 'r': repr, 'a': ascii}
+
+
 @macros.expr
 def s(tree, **kw):
     """Macro to easily interpolate values into string literals."""
-    captured = []
-    new_string = ""
-    chunks = re.split("{(.*?)}", tree.s)
-    for i in range(0, len(chunks)):
-        if i % 2 == 0:
-            new_string += chunks[i]
+    chunks = split(tree.s)
+    if len(chunks) == 1 and isinstance(chunks[0], str):
+        return ast.Str(chunks[0])
+    if compat.HAS_FSTRING:
+        return joined_str(chunks)
+    args = []
+    return ast.Call(ast.Attribute(ast.Str(template(chunks, args)), 'format',
+                                  ast.Load()),
+                    args, [])
+
+
+def joined_str(chunks):
+    return ast.JoinedStr([
+        ast.Str(chunk) if isinstance(chunk, str) else
+        ast.FormattedValue(
+            chunk[0], CONVERSIONS[chunk[1]] if chunk[1] else -1,
+            joined_str(chunk[2]) if chunk[2] else None)
+        for chunk in chunks])
+
+
+def template(chunks, args):
+    """The ``str.format`` template of `chunks`, appending the expressions
+    of its placeholders to `args`."""
+    parts = []
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            parts.append(chunk.replace("{", "{{").replace("}", "}}"))
         else:
-            new_string += "%s"
-            captured += [chunks[i]]
+            expr, conversion, spec = chunk
+            args.append(expr)
+            parts.append("{" + ("!" + conversion if conversion else "") +
+                         (":" + template(spec, args) if spec else "") + "}")
+    return "".join(parts)
+
+
+def split(text):
+    """The literal strings and the ``(expr, conversion, format_spec)``
+    placeholders of `text`, where `{{` and `}}` stand for braces as in
+    format strings and the format spec is split the same way. The
+    placeholders whose expression is a literal are formatted, and the
+    adjacent strings joined."""
+    chunks = [""]
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if char in "{}" and text[i + 1:i + 2] == char:
+            chunk = char
+            i += 2
+        elif char == "{":
+            end = closing_brace(text, i)
+            chunk = placeholder(text[i + 1:end])
+            i = end + 1
+        else:
+            chunk = char
+            i += 1
+        if isinstance(chunk, str) and isinstance(chunks[-1], str):
+            chunks[-1] += chunk
+        else:
+            chunks.append(chunk)
+    return [chunk for chunk in chunks if chunk != ""] or [""]
+
+
+def closing_brace(text, start):
+    """The index of the brace closing the one at `start`, skipping the
+    brackets and strings of the expression in between."""
+    depth = 0
+    quote = None
+    in_spec = False
+    i = start
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == "\\":
+                i += 1
+            elif text.startswith(quote, i):
+                i += len(quote) - 1
+                quote = None
+        elif char in "'\"" and not in_spec:
+            quote = text[i:i + 3] if text[i:i + 3] == char * 3 else char
+            i += len(quote) - 1
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+            if depth == 0:
+                return i
+        elif depth == 1 and (char == ":" or
+                             char == "!" and text[i + 1:i + 2] != "="):
+            in_spec = True
+        i += 1
+    raise SyntaxError("Unclosed placeholder in %r" % text)
+
 
-    result = hq[u[new_string] % tuple(ast_list[list(map(macropy.core.parse_expr, captured))])]
+def placeholder(text):
+    """The expression, conversion and split format spec of the
+    placeholder `text`, or its formatted value if the expression is a
+    literal."""
+    depth = 0
+    quote = None
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        elif depth == 0 and (char == ":" or
+                             char == "!" and text[i + 1:i + 2] != "="):
+            break
+    else:
+        i = len(text)
+    if not text[:i].strip():
+        raise SyntaxError("Empty placeholder {%s}" % text)
+    expr = macropy.core.parse_expr("(" + text[:i] + ")")
+    conversion = spec = None
+    rest = text[i:]
+    if rest.startswith("!"):
+        conversion, rest = rest[1:2], rest[2:]
+        if conversion not in CONVERSIONS:
+            raise SyntaxError("Invalid conversion in {%s}" % text)
+    if rest.startswith(":"):
+        spec = split(rest[1:])
+    elif rest:
+        raise SyntaxError("Invalid placeholder {%s}" % text)
 
-    return result
+    if spec is None or len(spec) == 1 and isinstance(spec[0], str):
+        try:
+            value = ast.literal_eval(expr)
+            if conversion:
+                value = CONVERTERS[conversion](value)
+            return format(value, spec[0] if spec else "")
+        except (ValueError, TypeError):
+            # not a literal, or a format spec which fails at run time
+            pass
+    return expr, conversion, spec
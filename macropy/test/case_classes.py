@@ -1,10 +1,35 @@
 # -*- coding: utf-8 -*-
+import copy
+import pickle
 import unittest
 
-from macropy.case_classes import macros, case, enum, enum_new
+from macropy.case_classes import (macros, case, enum, enum_new, frozen,
+                                   pack_records, unpack_records)
 from macropy.core.failure import MacroExpansionError
 from macropy.tracing import macros, show_expanded
 
+
+@frozen
+class Frozen(x, y | 0):
+    self.total = x + y
+
+
+@case
+class Shape(name):
+    class Circle(radius, [tags], {attrs}):
+        self.area = 3 * radius ** 2
+
+        def grow(self):
+            self.size = "big"
+
+
+@case
+class Square(width, height):
+    def __init__(self, side):
+        self.width = self.height = side
+        self.area = side * side
+
+
 class Tests(unittest.TestCase):
 
     def test_basic(self):
@@ -136,6 +161,16 @@ class Tests(unittest.TestCase):
 
         assert str(Point()) == "mooo Point(10, 10)"
 
+        @case
+        class Pair(a, b):
+            pass
+
+        class Shouting(Pair):
+            def __str__(self):
+                return "T!"
+
+        assert repr(Shouting(1, 2)) == "T!"
+
     def test_destructuring(self):
         @case
         class Point(x, y):
@@ -145,6 +180,178 @@ class Tests(unittest.TestCase):
         x, y = p
 
 
+    def test_hash(self):
+        @case
+        class Point(x, y, [rest]):
+            pass
+
+        assert hash(Point(1, 2)) == hash(Point(1, 2, 3))
+        assert {Point(1, 2): "a"}[Point(1, 2)] == "a"
+        assert len({Point(1, 2), Point(1, 2), Point(2, 1)}) == 2
+        assert Point(1, 2, 3).__getnewargs__() == (1, 2, 3)
+
+        @case
+        class Box(value):
+            def __eq__(self, other):
+                return True
+
+        assert Box(1) == Box(2)
+        with self.assertRaises(TypeError):
+            hash(Box(1))
+
+    def test_inherited_methods(self):
+        @case
+        class Tree():
+            def __str__(self):
+                return "tree"
+
+            def __iter__(self):
+                return iter("abc")
+
+            class Leaf(value):
+                pass
+
+            class Node(left, right):
+                def __iter__(self):
+                    yield self.left
+                    yield self.right
+
+        assert str(Tree.Leaf(1)) == repr(Tree.Leaf(1)) == "tree"
+        assert list(Tree.Leaf(1)) == ["a", "b", "c"]
+        assert list(Tree.Node(1, 2)) == [1, 2]
+        assert Tree.Node(1, 2) == Tree.Node(1, 2)
+        assert Tree.Node(1, 2) != Tree.Leaf(1)
+
+    def test_frozen(self):
+        p = Frozen(1, 2)
+        assert p.total == 3
+        assert p == Frozen(1, 2) and p != Frozen(2, 1)
+        assert {p: "a"}[Frozen(1, 2)] == "a"
+        assert hash(p) == hash(p) == hash(Frozen(1, 2))
+        with self.assertRaises(AttributeError):
+            p.x = 2
+        with self.assertRaises(AttributeError):
+            p.total = 2
+        with self.assertRaises(AttributeError):
+            del p.y
+        assert p.x == 1
+
+        assert p.copy() is p
+        assert p.copy(x=1) is p
+        assert copy.copy(p) is p
+        assert p.copy(y=5) == Frozen(1, 5)
+        assert p.copy(y=5).total == 6
+
+        for q in [pickle.loads(pickle.dumps(p)), copy.deepcopy(p)]:
+            assert q == p and q is not p
+            assert q.total == 3 and hash(q) == hash(p)
+            with self.assertRaises(AttributeError):
+                q.x = 2
+
+        @frozen
+        class Expr():
+            class Num(value):
+                pass
+
+            class Add(left, right):
+                def __init__(self, left, right):
+                    self.left = left
+                    self.right = right
+
+        e = Expr.Add(Expr.Num(1), Expr.Num(2))
+        assert isinstance(e, Expr)
+        assert e == Expr.Add(Expr.Num(1), Expr.Num(2))
+        assert len({e, Expr.Add(Expr.Num(1), Expr.Num(2))}) == 1
+        with self.assertRaises(AttributeError):
+            e.left = Expr.Num(3)
+
+    def test_pickle(self):
+        circle = Shape.Circle(2, "a", "b", color="red")
+        circle.grow()
+        assert Shape.Circle.__qualname__ == "Shape.Circle"
+
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copied = pickle.loads(pickle.dumps(circle, protocol))
+            assert copied == circle and type(copied) is Shape.Circle
+            assert copied.tags == ("a", "b")
+            assert copied.attrs == {"color": "red"}
+            assert copied.area == 12 and copied.size == "big"
+            assert pickle.loads(pickle.dumps(Frozen(1), protocol)) == \
+                Frozen(1)
+            copied = pickle.loads(pickle.dumps(Square(3), protocol))
+            assert copied == Square(3) and copied.area == 9
+
+    def test_pack_records(self):
+        records = [Frozen(i, i / 3) for i in range(100)]
+        assert unpack_records(pack_records(records)) == records
+
+        records = [Shape("caf\u00e9"), Shape("x" * 300), Shape(None)]
+        assert unpack_records(pack_records(records)) == records
+        records = [Shape(2 ** 80), Shape(True), Shape(False)]
+        assert unpack_records(pack_records(records)) == records
+        for values in [[-1, 1000], [-2 ** 40, 0], ["a", "b", "a", "a"],
+                       ["\ud800", "a", "\ud800", "\ud800"]]:
+            records = list(map(Shape, values))
+            assert unpack_records(pack_records(records)) == records
+
+        circles = [Shape.Circle(1, "a", color="red"), Shape.Circle(2)]
+        copied = unpack_records(pack_records(circles))
+        assert copied == circles
+        assert [c.tags for c in copied] == [("a",), ()]
+        assert [c.attrs for c in copied] == [{"color": "red"}, {}]
+
+        assert unpack_records(pack_records([])) == []
+        with self.assertRaises(TypeError):
+            pack_records([Shape(1), Frozen(1)])
+        with self.assertRaises(ValueError):
+            unpack_records(pickle.dumps(records))
+
+    def test_batch(self):
+        @case
+        class Point(x, y, label | ""):
+            pass
+
+        batch = Point.Batch(Point(i, i / 2) for i in range(10))
+        assert len(batch) == 10 and Point.Batch is type(batch)
+        assert batch.column("x").typecode == "q"
+        assert batch.column("y").typecode == "d"
+        assert batch.column("label") == [""] * 10
+        assert [p.x for p in batch] == list(range(10))
+        assert batch[-1].y == 4.5 and tuple(batch[3]) == (3, 1.5, "")
+        assert batch[3].instance() == Point(3, 1.5)
+        assert batch[2:4].to_instances() == [Point(2, 1.0), Point(3, 1.5)]
+        with self.assertRaises(IndexError):
+            batch[10]
+
+        view = batch[0]
+        batch.append(Point(2 ** 70, 1, "big"))
+        batch.extend([Point(-1, 0.0)])
+        assert type(batch.column("x")) is list and len(batch) == 12
+        assert view.x == 0 and batch[10].label == "big"
+        with self.assertRaises(TypeError):
+            batch.append((1, 2, 3))
+
+        moved = batch.copy(x=0, label=[str(i) for i in range(12)])
+        assert moved.column("x").tolist() == [0] * 12
+        assert moved[4].instance() == Point(0, 2.0, "4")
+        assert batch[4].instance() == Point(4, 2.0)
+        with self.assertRaises(ValueError):
+            batch.copy(y=[1.0])
+
+        small = batch.filter(lambda p: p.x < 3)
+        assert small.to_instances() == [Point(0, 0.0), Point(1, 0.5),
+                                        Point(2, 1.0), Point(-1, 0.0)]
+        assert len(batch.filter([True] + [False] * 11)) == 1
+
+        columns = Point.Batch.from_columns(x=[1, 2], y=[0.5, 1.5],
+                                           label=["a", "b"])
+        assert columns.to_instances() == [Point(1, 0.5, "a"),
+                                          Point(2, 1.5, "b")]
+
+        batch = Shape.Circle.Batch([Shape.Circle(1, "a", color="red")])
+        assert pickle.loads(pickle.dumps(batch)).to_instances() == \
+            [Shape.Circle(1, "a", color="red")]
+
     # TODO: test temporarily disabled due to disabling MacroExpansionErrors
 
     # def test_definition_error(self):
@@ -273,6 +480,16 @@ class Tests(unittest.TestCase):
         # methods
         assert Direction.South.padded_name(2) == "  South  "
 
+        # selecting by unique fields, hashable or not
+        assert Direction(continents=["Pandaria"]) is Direction.South
+        with self.assertRaises(ValueError) as e:
+            Direction(alignment="Vertical")
+        assert "Direction.North and Direction.South" in str(e.exception)
+        with self.assertRaises(ValueError):
+            Direction(name="Up")
+        with self.assertRaises(ValueError):
+            Direction(id=[4])
+
     # TODO: test temporarily disabled due to disabling MacroExpansionErrors
 
     # def test_enum_error(self):
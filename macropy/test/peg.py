@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 import sys
+import threading
 import unittest
 
-from macropy.peg import macros, peg, Success, cut, ParseError
+from macropy.peg import macros, peg, Success, Failure, cut, ParseError
 from macropy.tracing import macros, require
 from macropy.quick_lambda import macros, f, _
 
@@ -180,6 +182,136 @@ class Tests(unittest.TestCase):
             expr1.parse_string("1bc").index == 1
             expr2.parse_string("1bc").output == ['1', 'b', 'c']
 
+    def test_left_recursion(self):
+        with peg:
+            expr = (expr is a, "-", num is b) >> a - b | num
+            num = '[0-9]+'.r // int
+
+        with require:
+            expr.parse("10") == 10
+            expr.parse("10-3-2") == 5
+            expr.parse_partial("10-3-").output == 7
+            expr.parse_string("10-3-").index == 4
+            expr.parse_string("-3").index == 0
+
+        with peg:
+            call = (postfix, "()") // f[_[0] + "()"]
+            index = (postfix, "[", ident, "]") >> postfix + "[" + ident + "]"
+            postfix = call | index | ident
+            ident = '[a-z]+'.r
+
+        with require:
+            postfix.parse("a") == "a"
+            postfix.parse("a()[b]()") == "a()[b]()"
+            postfix.parse("a[b][c]") == "a[b][c]"
+
+    def test_first_set_dispatch(self):
+        with peg:
+            keyword = ("if" | "in" | "for" | "from" | "while" | ""), "!"
+            seq = (cut, "x") | "y"
+
+        with require:
+            keyword.parse("if!") == ["if", "!"]
+            keyword.parse("from!") == ["from", "!"]
+            keyword.parse("!") == ["", "!"]
+            keyword.parse_string("else!").index == 0
+            seq.parse_string("y").index == 0
+
+        parser = peg["ab" | "ac" | "b".r | "a"]
+        with require:
+            parser.parse_partial("ac").output == "ac"
+            parser.parse_partial("b").output == "b"
+            parser.parse_partial("ad").output == "a"
+            parser.dispatch["a"] == tuple(parser.children[i] for i in [0, 1, 2, 3])
+            parser.fallback == (parser.children[2],)
+
+    def test_concurrent_parsing(self):
+        with peg:
+            expr = (expr is a, "-", term is b) >> a - b | term
+            term = ("(", cut, expr, ")") // f[_[1]] | num
+            num = ('0' | '1' | '2' | '3' | '4' | '5' | '6' | '7' | '8' |
+                   '9').rep1.join // int
+
+        strings = []
+        for i in range(1, 30):
+            strings.append("-".join(map(str, range(i))))
+            strings.append("(" * i + "%d-1" % i + ")" * i)
+        expected = [(0 - sum(range(1, i))) for i in range(1, 30)]
+        expected = [x for pair in zip(expected, range(0, 29)) for x in pair]
+
+        start = threading.Barrier(8)
+
+        def work(n):
+            # the grammar is analyzed by whichever thread gets there first
+            start.wait()
+            return [expr.parse(s) for s in strings] + \
+                [expr.parse_string(s + ")").index for s in strings]
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(work, range(8)))
+
+        for result in results:
+            assert result[:len(strings)] == expected
+            assert result[len(strings):] == list(map(len, strings))
+
+    def test_parse_many(self):
+        with peg:
+            pair = ('[a-z]+'.r is k, "=", '[0-9]+'.r is v) >> (k, int(v))
+            newline = "\r\n"
+
+        text = "\r\n".join("k=%d" % i if i % 50 != 7 else "bad=%d!" % i
+                            for i in range(300)) + "\r\n"
+        expected = [("k", i) for i in range(300) if i % 50 != 7]
+
+        for processes in [1, 3]:
+            results = pair.parse_many(text, newline, processes, chunk_size=64)
+            successes = [r for r in results if type(r) is Success]
+            failures = [r for r in results if type(r) is Failure]
+            with require:
+                len(results) == 300
+                [r.output for r in successes] == expected
+                text[successes[10].remaining.index:].startswith("\r\nk=12")
+                [text[r.index] for r in failures] == ["!"] * 6
+                [text.rfind("bad", 0, r.index) for r in failures] == \
+                    [text.find("bad=%d!" % i) for i in range(7, 300, 50)]
+                # the stacks are made of the parsers of this process
+                failures[0].failed[0] is newline
+                failures[0].failed == failures[-1].failed
+
+            with self.assertRaises(ParseError) as e:
+                raise ParseError(failures[1])
+            assert str(e.exception) == (
+                "index: 341, line: 58, col: 7\n"
+                "newline\n"
+                "bad=57!\r\n"
+                "      ^\n"
+                "expected: '\\r\\n'")
+
+        with require:
+            pair.parse_many("", newline) == []
+            [r.output for r in pair.parse_many("a=1\r\nb=2", newline)] == \
+                [("a", 1), ("b", 2)]
+            pair.parse_many("a=1\r\nb=", newline)[1].index == 7
+
+    def test_failure_trace(self):
+        with peg:
+            expr = ("(", cut, expr, ")") | "x"
+
+        res = expr.parse_string("((y))")
+        with require:
+            res.index == 2
+            res.fatal
+            res.trace == ['expr', 'expr', 'expr']
+            res.failed[0] is expr
+            res.failed[-1] is expr.parser
+            len(res.failed) == 8
+
+        # failed is built from the stack for the callers which read it
+        res.failed.clear()
+        assert len(res.failed) == 8
+        with self.assertRaises(AttributeError):
+            res.failed = []
+
     def test_short_str(self):
         with peg:
             p1 = "omg"
@@ -1,10 +1,25 @@
 import ast
+import gc
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+import weakref
 
 from macropy.quick_lambda import macros, f, _, lazy, interned
+from macropy.quick_lambda import shared, InternStore, DiskInternStore
 from macropy.tracing import macros, show_expanded
 from functools import reduce
 
+squares_calls = []
+
+
+def squares(n):
+    squares_calls.append(n)
+    return {i: i * i for i in range(n)}
+
+
 class Tests(unittest.TestCase):
     def test_basic(self):
         assert list(map(f[_ - 1], [1, 2, 3])) == [0, 1, 2]
@@ -44,6 +59,58 @@ class Tests(unittest.TestCase):
         thunk()
         assert wrapped[0] == 1
 
+    def test_lazy_threads(self):
+        calls = []
+        started = threading.Event()
+
+        def slow():
+            calls.append(1)
+            started.wait()
+            return object()
+
+        thunk = lazy[slow()]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(thunk()))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        started.set()
+        for thread in threads:
+            thread.join()
+        assert len(calls) == 1
+        assert len(results) == 8
+        assert all(result is results[0] for result in results)
+
+    def test_lazy_releases_closure(self):
+        class Big(object):
+            pass
+
+        def make_thunk():
+            big = Big()
+            return weakref.ref(big), lazy[len([big])]
+
+        ref, thunk = make_thunk()
+        assert ref() is not None
+        assert thunk() == 1
+        gc.collect()
+        assert ref() is None
+        assert thunk() == 1
+
+    def test_lazy_retries_errors(self):
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise ValueError()
+            return len(attempts)
+
+        thunk = lazy[flaky()]
+        with self.assertRaises(ValueError):
+            thunk()
+        assert thunk() == 2
+        assert thunk() == 2
+
     def test_interned(self):
 
         wrapped = [0]
@@ -58,3 +125,88 @@ class Tests(unittest.TestCase):
         assert wrapped[0] == 1
         wrapped_func()
         assert wrapped[0] == 1
+
+    def test_interned_shared(self):
+        calls = []
+
+        def table(n):
+            calls.append(n)
+            return {i: i * i for i in range(n)}
+
+        def first():
+            return interned(shared)[table(10)]
+
+        def second():
+            return interned(shared)[table(10)]
+
+        def other():
+            return interned(shared)[table(20)]
+
+        assert first() is second()
+        assert first() is second()
+        assert len(other()) == 20
+        assert calls == [10, 20]
+
+        store = InternStore()
+
+        def elsewhere():
+            return interned(store)[table(10)]
+
+        assert elsewhere() == first()
+        assert elsewhere() is not first()
+        assert calls == [10, 20, 10]
+
+        # the same expression, with its names bound to other values
+        def same_table(table):
+            return interned(shared)[table(10)]
+
+        def other_table(table):
+            return interned(shared)[table(10)]
+
+        assert same_table(table) is first()
+        assert other_table(lambda n: n) == 10
+        assert calls == [10, 20, 10]
+
+    def test_interned_disk(self):
+        directory = tempfile.mkdtemp()
+        try:
+            del squares_calls[:]
+
+            def first(store):
+                return interned(store)[squares(10)], interned(store)[f[_]]
+
+            def second(store):
+                return interned(store)[squares(10)], interned(store)[f[_]]
+
+            value, func = first(DiskInternStore(directory))
+            assert squares_calls == [10]
+            assert len(os.listdir(directory)) == 1
+
+            # a new process, with another store and call site
+            loaded, other_func = second(DiskInternStore(directory))
+            assert squares_calls == [10]
+            assert loaded == value
+            assert other_func is not func
+
+            def third(store):
+                return interned(store)[squares(10)]
+
+            assert third(DiskInternStore(directory, version=2)) == value
+            assert squares_calls == [10, 10]
+
+            # a local function can't be found by other processes, so
+            # the sites calling it are not shared
+            def squares_here(n):
+                return squares(n)
+
+            def fourth(store):
+                return interned(store)[squares_here(10)]
+
+            def fifth(store):
+                return interned(store)[squares_here(10)]
+
+            assert fourth(DiskInternStore(directory)) == value
+            assert fifth(DiskInternStore(directory)) == value
+            assert squares_calls == [10, 10, 10, 10]
+        finally:
+            shutil.rmtree(directory)
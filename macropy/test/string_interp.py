@@ -1,9 +1,17 @@
+import ast
 import unittest
+from unittest import mock
 
 
+from macropy import string_interp
+from macropy.core import compat
 from macropy.string_interp import macros, s
 
 
+def expand(text):
+    return string_interp.s(tree=ast.Str(text))
+
+
 class Tests(unittest.TestCase):
     def test_string_interpolate(self):
         a, b = 1, 2
@@ -17,3 +25,33 @@ class Tests(unittest.TestCase):
         c = s["{apple_count} {'apples'} and {apple_count + banana_delta} {''.join(['b', 'a', 'n', 'a', 'n', 'a', 's'])}"]
 
         assert(c == "10 apples and 14 bananas")
+
+    def test_format_specs(self):
+        x, width, name = 3.14159, 8, "pear"
+        assert s["{x:.2f}|{x:>{width}.3}|{name!r}|{name!r:>8}"] == \
+            "3.14|    3.14|'pear'|  'pear'"
+        assert s["{{literal}} {x:.1f} {{{name}}}"] == "{literal} 3.1 {pear}"
+        assert s["{ {'a': 1}['a'] } {x!s:.3}"] == "1 3.1"
+        assert s["{width != 8}"] == "False"
+
+    def test_constant_folding(self):
+        assert isinstance(expand("no placeholders"), ast.Str)
+        assert isinstance(expand("{'apples'} and {3:03d}"), ast.Str)
+        assert s["{'apples'} and {3:03d} {'x'!r}"] == "apples and 003 'x'"
+        n = 2
+        if compat.HAS_FSTRING:
+            tree = expand("{n} {'apples'} and {3} pears")
+            assert isinstance(tree, ast.JoinedStr)
+            assert [v.s for v in tree.values if isinstance(v, ast.Str)] == \
+                [" apples and 3 pears"]
+        assert s["{n} {'apples'} and {3} pears"] == "2 apples and 3 pears"
+
+    def test_format_method(self):
+        # the expansion on Pythons without f-strings
+        with mock.patch.object(compat, 'HAS_FSTRING', False):
+            tree = expand("{x:>{width}} {{b}} {name!r} {'c'}")
+        assert isinstance(tree, ast.Call)
+        code = compile(ast.fix_missing_locations(ast.Expression(tree)),
+                       "<string_interp>", "eval")
+        assert eval(code, {'x': 1, 'width': 3, 'name': 'n'}) == \
+            "  1 {b} 'n' c"
@@ -0,0 +1,5 @@
+import macropy.activate
+
+import macropy.benchmarks
+
+macropy.benchmarks.main()
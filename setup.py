@@ -20,7 +20,7 @@ setup(
     maintainer='Alberto Berti',
     maintainer_email='alberto@metapensiero.it',
     url='https://github.com/lihaoyi/macropy',
-    packages=find_packages(exclude=["*.test", "*.test.*"]),
+    packages=find_packages(exclude=["*.test", "*.test.*", "*.benchmarks"]),
     extras_require={
         'pyxl':  ["pyxl3"],
         'pinq': ["SQLAlchemy"],